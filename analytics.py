@@ -0,0 +1,155 @@
+"""跨项目的完成情况统计，依赖 numpy
+
+    python -m punch_manager report --out ./report
+"""
+import csv
+import os
+
+import numpy as np
+
+from storage import MemberTable
+
+
+# 矩阵取值
+NOT_ASSIGNED = -1
+UNFINISHED = 0
+FINISHED = 1
+
+
+def _rate(done, total):
+    """完成率，total 为 0 处为 nan"""
+    return np.divide(done, total, out=np.full(np.shape(done), np.nan), where=total > 0)
+
+
+def _rate_value(rate):
+    """导出行中的完成率：没有数据时为 None，否则为 float"""
+    return None if np.isnan(rate) else float(rate)
+
+
+def format_rate(rate):
+    """完成率的显示文字"""
+    return '' if rate is None else f"{rate:.4f}"
+
+
+class StatusMatrix:
+    """人员 × 项目 的状态矩阵
+
+    每行一名人员，每列一个项目（按创建时间排序），取值为 NOT_ASSIGNED / UNFINISHED / FINISHED。
+    各项统计都是对整个矩阵的向量化运算。
+    """
+
+    def __init__(self, processes):
+        members = MemberTable()
+        self.process_names = sorted(processes, key=lambda name: processes[name]['info'].get('create_time', ''))
+        self.create_times = [processes[name]['info'].get('create_time', '') for name in self.process_names]
+        columns = [(members.ids_of(processes[name]['unfinished']), members.ids_of(processes[name]['finished']))
+                   for name in self.process_names]
+        self.member_names = list(members.names)
+
+        self.status = np.full((len(self.member_names), len(self.process_names)), NOT_ASSIGNED, dtype=np.int8)
+        for j, (unfinished, finished) in enumerate(columns):
+            self.status[np.array(unfinished, dtype=np.intp), j] = UNFINISHED
+            self.status[np.array(finished, dtype=np.intp), j] = FINISHED
+
+    @property
+    def assigned(self):
+        return self.status != NOT_ASSIGNED
+
+    @property
+    def finished(self):
+        return self.status == FINISHED
+
+    def member_counts(self):
+        """每人的 (参与项目数, 完成项目数, 完成率)"""
+        total = self.assigned.sum(axis=1)
+        done = self.finished.sum(axis=1)
+        return total, done, _rate(done, total)
+
+    def process_counts(self):
+        """每个项目的 (人数, 完成人数, 完成率)"""
+        total = self.assigned.sum(axis=0)
+        done = self.finished.sum(axis=0)
+        return total, done, _rate(done, total)
+
+    def streaks(self):
+        """每人按项目创建顺序的 (最长连续完成数, 当前连续完成数)
+
+        未参与的项目既不中断也不延续连续记录。
+        """
+        if not self.process_names:
+            zeros = np.zeros(len(self.member_names), dtype=np.int64)
+            return zeros, zeros.copy()
+        done = np.cumsum(self.finished, axis=1)
+        # 每个位置之前最后一次未完成时的累计完成数（累计值单调不减）
+        last_miss = np.maximum.accumulate(np.where(self.status == UNFINISHED, done, 0), axis=1)
+        run = done - last_miss
+        return run.max(axis=1), run[:, -1]
+
+    def never_completed(self):
+        """参与过项目但从未完成过的人员"""
+        total, done, _ = self.member_counts()
+        return [self.member_names[i] for i in np.flatnonzero((total > 0) & (done == 0))]
+
+    def monthly_counts(self):
+        """按项目创建月份汇总的 (月份列表, 人次, 完成人次, 完成率)"""
+        months, inverse = np.unique(np.array([t[:7] for t in self.create_times], dtype=str), return_inverse=True)
+        total, done, _ = self.process_counts()
+        total = np.bincount(inverse, weights=total, minlength=len(months))
+        done = np.bincount(inverse, weights=done, minlength=len(months))
+        return [str(month) for month in months], total.astype(np.int64), done.astype(np.int64), _rate(done, total)
+
+    # ---------- 导出 ----------
+
+    def member_rows(self):
+        total, done, rate = self.member_counts()
+        longest, current = self.streaks()
+        for i, name in enumerate(self.member_names):
+            yield name, int(total[i]), int(done[i]), _rate_value(rate[i]), int(longest[i]), int(current[i])
+
+    def process_rows(self):
+        total, done, rate = self.process_counts()
+        for j, name in enumerate(self.process_names):
+            yield name, self.create_times[j], int(total[j]), int(done[j]), _rate_value(rate[j])
+
+    def month_rows(self):
+        months, total, done, rate = self.monthly_counts()
+        for k, month in enumerate(months):
+            yield month, int(total[k]), int(done[k]), _rate_value(rate[k])
+
+    def matrix_rows(self):
+        """逐行生成矩阵：已完成 1，未完成 0，未参与留空"""
+        labels = np.array(['', '0', '1'])
+        for i, name in enumerate(self.member_names):
+            yield [name] + labels[self.status[i] + 1].tolist()
+
+
+MEMBER_HEADER = ['人员', '参与项目', '已完成', '完成率', '最长连续完成', '当前连续完成']
+PROCESS_HEADER = ['项目', '创建时间', '人数', '已完成', '完成率']
+MONTH_HEADER = ['月份', '人次', '已完成', '完成率']
+
+
+def write_csv(path, header, rows):
+    """逐行写出 CSV（带 BOM，Excel 可直接打开）"""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        # 行中的 float 只有完成率
+        writer.writerows([format_rate(value) if isinstance(value, float) else value for value in row]
+                         for row in rows)
+
+
+def export_csv(matrix, directory):
+    """在 directory 下写出 members / processes / months / matrix 四个 CSV，返回文件路径"""
+    os.makedirs(directory, exist_ok=True)
+    files = [
+        ('members.csv', MEMBER_HEADER, matrix.member_rows()),
+        ('processes.csv', PROCESS_HEADER, matrix.process_rows()),
+        ('months.csv', MONTH_HEADER, matrix.month_rows()),
+        ('matrix.csv', ['人员'] + matrix.process_names, matrix.matrix_rows()),
+    ]
+    paths = []
+    for file_name, header, rows in files:
+        path = os.path.join(directory, file_name)
+        write_csv(path, header, rows)
+        paths.append(path)
+    return paths
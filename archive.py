@@ -0,0 +1,198 @@
+"""已关闭项目的冷归档
+
+    data/archive/index.json          项目名 -> 元数据（所在分段、时间、人数），列表只读它
+    data/archive/segment-*.json.xz   lzma 压缩的 {项目名: 项目}，只在恢复或查看时解压
+
+mode 改为 off 的项目移入归档，process.json 只保留进行中的项目，启动时不再读取和索引已关闭的项目。
+"""
+import json
+import lzma
+import os
+import threading
+import time
+
+from storage import FileLock, write_json_atomic, TIME_FORMAT
+from tracing import span
+
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.json.xz'
+# 解压后保留在内存中的分段数
+SEGMENT_CACHE = 4
+# lzma 压缩级别：名单数据在 1 级约压缩到 1/5，比默认的 6 级快十几倍，批量归档时不卡界面
+COMPRESS_PRESET = 1
+
+
+def summarize(process):
+    """列表显示用的元数据，不含名单"""
+    info = process['info']
+    return {
+        'mode': info.get('mode', 'off'),
+        'create_time': info.get('create_time', ''),
+        'description': info.get('description', ''),
+        'update_time': process.get('update_time', ''),
+        'finished': len(process['finished']),
+        'unfinished': len(process['unfinished'])
+    }
+
+
+class ProcessArchive:
+    """归档中的项目
+
+    每次归档写入一个新的压缩分段，再原子替换索引；恢复或删除项目时只改索引，
+    分段中的项目都不再被引用时删除分段文件。多个站点共享 data 目录时，修改在文件锁内进行。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_file = os.path.join(directory, 'index.json')
+        self._lock = FileLock(os.path.join(directory, 'archive.lock'))
+        self._index = {}
+        self._index_mtime = None
+        # 分段文件名 -> {项目名: 项目}，最近使用的在后
+        self._segments = {}
+        self._segments_lock = threading.Lock()
+
+    # ---------- 索引 ----------
+
+    def _read_index(self):
+        """index.json 被其他实例修改过时重新读取"""
+        try:
+            mtime = os.stat(self.index_file).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._index_mtime:
+            if mtime is None:
+                self._index = {}
+            else:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    self._index = json.load(f)
+            self._index_mtime = mtime
+        return self._index
+
+    def _write_index(self, index):
+        write_json_atomic(self.index_file, index)
+        self._index = index
+        self._index_mtime = os.stat(self.index_file).st_mtime_ns
+
+    def index(self):
+        """{项目名: 元数据}，元数据含 segment 和 archived_time"""
+        with self._lock:
+            return {name: dict(meta) for name, meta in self._read_index().items()}
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._read_index()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._read_index())
+
+    # ---------- 分段 ----------
+
+    def _segment(self, segment):
+        with self._segments_lock:
+            data = self._segments.pop(segment, None)
+            if data is None:
+                with span('archive.decompress', segment=segment):
+                    with open(os.path.join(self.directory, segment), 'rb') as f:
+                        data = json.loads(lzma.decompress(f.read()).decode('utf-8'))
+            self._segments[segment] = data
+            while len(self._segments) > SEGMENT_CACHE:
+                self._segments.pop(next(iter(self._segments)))
+            return data
+
+    def _write_segment(self, processes):
+        """写入一个新的分段，返回文件名"""
+        os.makedirs(self.directory, exist_ok=True)
+        segment = f"{SEGMENT_PREFIX}{time.time_ns():020d}{SEGMENT_SUFFIX}"
+        path = os.path.join(self.directory, segment)
+        with span('archive.compress', processes=len(processes)):
+            body = lzma.compress(json.dumps(processes, ensure_ascii=False).encode('utf-8'), preset=COMPRESS_PRESET)
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+        return segment
+
+    def _drop_unreferenced(self, index, segments):
+        """删除不再被索引引用的分段文件"""
+        referenced = {meta['segment'] for meta in index.values()}
+        for segment in set(segments) - referenced:
+            with self._segments_lock:
+                self._segments.pop(segment, None)
+            try:
+                os.remove(os.path.join(self.directory, segment))
+            except FileNotFoundError:
+                pass
+
+    # ---------- 读写 ----------
+
+    def add(self, processes):
+        """把 {项目名: 项目} 写入一个新分段并加入索引，已归档的同名项目被替换"""
+        if not processes:
+            return
+        with self._lock:
+            segment = self._write_segment(processes)
+            index = dict(self._read_index())
+            replaced = [index[name]['segment'] for name in processes if name in index]
+            archived_time = time.strftime(TIME_FORMAT)
+            for name, process in processes.items():
+                meta = summarize(process)
+                meta['segment'] = segment
+                meta['archived_time'] = archived_time
+                index[name] = meta
+            self._write_index(index)
+            self._drop_unreferenced(index, replaced)
+
+    def get(self, name):
+        """解压并返回归档的项目（副本），不存在时返回 None"""
+        with self._lock:
+            meta = self._read_index().get(name)
+            if meta is None:
+                return None
+            process = self._segment(meta['segment'])[name]
+        return json.loads(json.dumps(process))
+
+    def load_all(self):
+        """解压全部分段，返回 {项目名: 项目}"""
+        with self._lock:
+            index = self._read_index()
+            by_segment = {}
+            for name, meta in index.items():
+                by_segment.setdefault(meta['segment'], []).append(name)
+            data = {}
+            for segment, names in by_segment.items():
+                processes = self._segment(segment)
+                for name in names:
+                    data[name] = processes[name]
+        return json.loads(json.dumps(data))
+
+    def remove(self, name):
+        """从归档中移除项目（已恢复或删除）"""
+        self.remove_all([name])
+
+    def remove_all(self, names):
+        """从归档中移除多个项目，只重写一次索引"""
+        with self._lock:
+            index = dict(self._read_index())
+            removed = [index.pop(name) for name in names if name in index]
+            if not removed:
+                return
+            self._write_index(index)
+            self._drop_unreferenced(index, [meta['segment'] for meta in removed])
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def open_archive(directory):
+    """按路径返回共享的归档实例"""
+    key = os.path.abspath(directory)
+    with _archives_lock:
+        if key not in _archives:
+            _archives[key] = ProcessArchive(directory)
+        return _archives[key]
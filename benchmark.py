@@ -0,0 +1,296 @@
+"""核心路径的性能基准
+
+    python benchmark.py run --scale small,medium
+    python benchmark.py run --scale large --repeat 3
+    python benchmark.py generate --members 10000 --processes 1000 --out ./bench-data
+
+run 在临时目录中生成各规模的 process.json / config.json，在 offscreen 平台下计时主窗口的
+各项操作，结果追加到 benchmark_results.jsonl（带版本号），并与同一规模上一次的结果比较，
+变慢超过阈值的项目标记为回归。
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from storage import TIME_FORMAT, write_json_atomic
+
+
+# 规模：(人数, 项目数)
+SCALES = {
+    'tiny': (10, 1),
+    'small': (100, 10),
+    'medium': (1000, 100),
+    'large': (10000, 1000),
+    'huge': (100000, 5000),
+}
+# 除最近项目外，每个项目名单的人数上限
+ROSTER_SIZE = 200
+# 单次 label_clicked 计时的点击次数
+CLICKS = 200
+RESULTS_FILE = 'benchmark_results.jsonl'
+# 比上一次慢这么多（比例）视为回归
+REGRESSION_THRESHOLD = 0.2
+# 相差不到这么多毫秒时不算回归，避免极短操作的抖动
+REGRESSION_MIN_MS = 0.05
+
+SURNAMES = '赵钱孙李周吴郑王冯陈褚卫蒋沈韩杨朱秦尤许何吕施张孔曹严华金魏陶姜'
+GIVEN = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉兰萍鹏辉建国红'
+
+
+# ---------- 数据生成 ----------
+
+def member_names(count, seed=0):
+    """生成 count 个互不相同的姓名"""
+    rng = random.Random(seed)
+    names = dict()
+    while len(names) < count:
+        name = rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN) for _ in range(rng.choice((1, 2))))
+        if name in names:
+            name += str(len(names))
+        names[name] = None
+    return list(names)
+
+
+def generate(directory, members, processes, seed=0):
+    """在 directory 下写入合成的 process.json 和 config.json
+
+    最近更新的项目包含全部人员，其余项目各取 ROSTER_SIZE 人，约 60% 已完成。
+    """
+    rng = random.Random(seed)
+    names = member_names(members, seed)
+    start = datetime(2024, 1, 1)
+    data = {}
+    for i in range(processes):
+        latest = i == processes - 1
+        roster = names if latest else rng.sample(names, min(ROSTER_SIZE, members))
+        finished = [name for name in roster if rng.random() < 0.6]
+        finished_set = set(finished)
+        created = start + timedelta(hours=i)
+        updated = created + timedelta(minutes=30)
+        data[f"项目{i:05d}"] = {
+            "info": {
+                "at_name": [],
+                "create_time": created.strftime(TIME_FORMAT),
+                "description": "benchmark",
+                "mode": "on" if latest or rng.random() < 0.2 else "off"
+            },
+            "unfinished": [name for name in roster if name not in finished_set],
+            "finished": finished,
+            "change": {
+                "new_finished": finished[:5],
+                "new_unfinished": []
+            },
+            "update_time": updated.strftime(TIME_FORMAT),
+            "update_ts": updated.timestamp()
+        }
+    os.makedirs(directory, exist_ok=True)
+    write_json_atomic(os.path.join(directory, 'process.json'), data)
+    write_json_atomic(os.path.join(directory, 'config.json'), {
+        "webhook_url": "",
+        "secret": "",
+        "name": [],
+        "dingtalk_bot": "关闭"
+    })
+    return data
+
+
+# ---------- 计时 ----------
+
+def measure(func, repeat, setup=None):
+    """执行 repeat 次，返回 {'min', 'median'}（毫秒）；setup 在每次计时前执行且不计时"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return {'min': round(min(times), 3), 'median': round(statistics.median(times), 3)}
+
+
+def run_scale(scale, repeat, source_dir):
+    """在临时目录中生成数据并依次计时，返回 {项目: 计时}"""
+    members, processes = SCALES[scale]
+    workdir = tempfile.mkdtemp(prefix=f'punch-bench-{scale}-')
+    cwd = os.getcwd()
+    try:
+        # 主窗口使用相对路径 ./data 和 ./ui
+        shutil.copytree(os.path.join(source_dir, 'ui'), os.path.join(workdir, 'ui'),
+                        ignore=shutil.ignore_patterns('compiled'))
+        os.chdir(workdir)
+        generate('./data', members, processes)
+        return run_benchmarks(repeat)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_benchmarks(repeat):
+    from PyQt6.QtWidgets import QApplication
+    from storage import JournalStore
+    from repository import ProcessRepository
+    from dingtalk import build_payloads
+    import main
+
+    app = QApplication.instance() or QApplication([])
+    results = {}
+
+    # 启动时读取全部数据（每次使用新的存储实例，不命中缓存）
+    results['load_data'] = measure(lambda: ProcessRepository(JournalStore('./data/process.json')), repeat)
+
+    windows = []
+    results['main_window'] = measure(lambda: windows.append(main.MainWindow()), repeat)
+    window = windows[-1]
+    process = window.current_process
+    results['get_latest_process'] = measure(window.get_latest_process, repeat)
+    results['setup_scroll_areas'] = measure(window.setup_scroll_areas, repeat)
+
+    # 在未完成一列中来回点击同一批人，每次计时 CLICKS 次点击
+    clicked = list(window.data[process]['unfinished'][:CLICKS])
+
+    def click_all():
+        for name in clicked:
+            window.label_clicked(name)
+
+    timing = measure(click_all, repeat)
+    results['label_clicked'] = {key: round(value / max(len(clicked), 1), 4) for key, value in timing.items()}
+
+    click_all()
+    results['update_layouts'] = measure(window.update_layouts, repeat)
+
+    # 每次保存前点击 10 人
+    def click_ten():
+        names = list(window.unfinished_model.names)[:10]
+        for name in names:
+            window.label_clicked(name)
+
+    # save_data 只计界面线程的耗时，save_flush 包括等待后台写入完成
+    results['save_data'] = measure(window.save_data, repeat, setup=click_ten)
+    window.repository.flush()
+    results['save_flush'] = measure(lambda: (window.save_data(), window.repository.flush()), repeat, setup=click_ten)
+
+    data = window.data[process]
+    results['dingtalk_markdown'] = measure(
+        lambda: build_payloads(process, [], data['change']['new_finished'], data['change']['new_unfinished'],
+                               data['finished'], data['unfinished']), repeat)
+
+    for w in windows:
+        w.close()
+        w.deleteLater()
+    app.processEvents()
+    return results
+
+
+# ---------- 记录与比较 ----------
+
+def current_version(source_dir):
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=source_dir,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def previous_results(path, scale):
+    """结果文件中同一规模最近一次的结果"""
+    last = None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry.get('scale') == scale:
+                    last = entry
+    except FileNotFoundError:
+        pass
+    return last
+
+
+def report(scale, results, previous):
+    """打印结果表，返回回归的项目列表"""
+    regressions = []
+    print(f"\n## {scale} {SCALES[scale]}" + (f"  对比 {previous['version']}" if previous else ""))
+    for name, timing in results.items():
+        line = f"{name:<20}{timing['median']:>12.3f} ms"
+        old = previous['results'].get(name) if previous else None
+        if old and old['median'] > 0:
+            change = timing['median'] / old['median'] - 1
+            line += f"{change:>+10.1%}"
+            if change > REGRESSION_THRESHOLD and timing['median'] - old['median'] > REGRESSION_MIN_MS:
+                line += "  回归"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def cmd_run(args):
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    version = current_version(source_dir)
+    output = os.path.abspath(args.output)
+    regressions = []
+    for scale in args.scale.split(','):
+        results = run_scale(scale, args.repeat, source_dir)
+        regressions += [f"{scale}/{name}" for name in report(scale, results, previous_results(output, scale))]
+        entry = {
+            'time': datetime.now().strftime(TIME_FORMAT),
+            'version': version,
+            'python': sys.version.split()[0],
+            'scale': scale,
+            'members': SCALES[scale][0],
+            'processes': SCALES[scale][1],
+            'repeat': args.repeat,
+            'results': results
+        }
+        with open(output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    if regressions:
+        print(f"\n回归：{', '.join(regressions)}")
+        return 1
+    return 0
+
+
+def cmd_generate(args):
+    generate(args.out, args.members, args.processes, args.seed)
+    print(f"已生成 {args.members} 人、{args.processes} 个项目：{args.out}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='benchmark', description='Punch Manager 性能基准')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p_run = subparsers.add_parser('run', help='运行基准并记录结果')
+    p_run.add_argument('--scale', default='small,medium',
+                       help=f"逗号分隔的规模（{', '.join(SCALES)}，默认 small,medium）")
+    p_run.add_argument('--repeat', type=int, default=5, help='每项重复次数（默认 5）')
+    p_run.add_argument('--output', default=RESULTS_FILE, help=f'结果文件（默认 {RESULTS_FILE}）')
+    p_run.set_defaults(func=cmd_run)
+
+    p_generate = subparsers.add_parser('generate', help='只生成合成数据')
+    p_generate.add_argument('--members', type=int, default=1000, help='人数')
+    p_generate.add_argument('--processes', type=int, default=100, help='项目数')
+    p_generate.add_argument('--seed', type=int, default=0, help='随机种子')
+    p_generate.add_argument('--out', default='./bench-data', help='输出目录')
+    p_generate.set_defaults(func=cmd_generate)
+
+    args = parser.parse_args(argv)
+    for scale in getattr(args, 'scale', '').split(','):
+        if scale and scale not in SCALES:
+            parser.error(f"未知规模：{scale}")
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,765 @@
+import itertools
+import json
+import os
+import threading
+import time
+import hmac
+import hashlib
+import base64
+import urllib.parse
+from datetime import datetime
+
+from storage import write_json_atomic
+from tracing import span, traced
+
+
+def sign_url(webhook_url, secret):
+    """为 Webhook 地址附加加签时间戳和签名"""
+    timestamp = str(round(time.time() * 1000))
+    secret_enc = secret.encode('utf-8')
+    string_to_sign = f"{timestamp}\n{secret}"
+    string_to_sign_enc = string_to_sign.encode('utf-8')
+    hmac_code = hmac.new(secret_enc, string_to_sign_enc, digestmod=hashlib.sha256).digest()
+    sign = urllib.parse.quote_plus(base64.b64encode(hmac_code))
+    return f"{webhook_url}&timestamp={timestamp}&sign={sign}"
+
+
+# 钉钉单条消息体（UTF-8 编码后的 JSON）的大小上限
+MAX_MESSAGE_BYTES = 20000
+
+REPO_FOOTER = "\n------\n开源项目仓库 <https://github.com/Return-Log/Punch-Manager>\n"
+
+# 使用设置中 webhook_url / secret 的推送目标名称
+DEFAULT_TARGET = "默认"
+
+# 重试可能成功的钉钉错误码：系统繁忙、发送太快被限流；其余错误码（如 310000 签名不匹配、消息过长）重试无用
+RETRYABLE_ERRCODES = {-1, 130101, 410100}
+
+
+def json_size(text):
+    """text 作为 JSON 字符串内容时 UTF-8 编码后的字节数（不含引号）"""
+    return len(json.dumps(text, ensure_ascii=False).encode('utf-8')) - 2
+
+
+def encode_payload(payload):
+    """消息体编码为 UTF-8 JSON，中文不转义以减小体积"""
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+
+class MarkdownBuilder:
+    """边写入边统计编码后大小的 Markdown 消息构建器
+
+    内容超过 limit 时自动另起一条消息，拆分后的每条标题带上 (序号/总数)，
+    被拆开的小节在下一条开头标注“（续）”；拆分正好落在小节末尾时不标注。@ 只出现在第一条中。
+    """
+
+    # 为 "（99/99）" 这样的分条标记预留空间
+    PART_MARK_RESERVE = "（99/99）"
+
+    def __init__(self, title, at_name=(), footer="", limit=MAX_MESSAGE_BYTES):
+        self.title = title
+        self.at_name = list(at_name)
+        self.footer = footer
+        self.limit = limit
+        self.parts = []
+        self._chunks = []
+        self._size = 0
+        self._section = None
+        # 新的一条中还没有写出被拆开小节的“（续）”标题
+        self._continue = False
+        self._line_open = False
+        # 标题、@、页脚和 JSON 外壳在每条消息中都要占用的字节数
+        base_text = self._header(self.PART_MARK_RESERVE, True) + self.footer
+        self._budget = limit - len(encode_payload(self._payload(base_text, True)))
+
+    def _header(self, mark, first):
+        at_name_text = "、".join([f"@{name}" for name in self.at_name]) if first else ""
+        return f"## {self.title}{mark}{'' if not at_name_text else ' ' + at_name_text}\n"
+
+    def _payload(self, text, first):
+        return {
+            "msgtype": "markdown",
+            "markdown": {
+                "title": "打卡信息",
+                "text": text
+            },
+            "at": {
+                "atMobiles": self.at_name if first else [],
+                "isAtAll": False
+            }
+        }
+
+    def _continuation(self):
+        return f"### {self._section}（续）\n" if self._continue else ""
+
+    def _write(self, text):
+        if self._chunks and self._size + json_size(self._continuation() + text) > self._budget:
+            self._new_part()
+            if text == "\n":
+                # 拆分正好落在行尾，小节已经写完，新的一条不需要续写
+                return
+            if self._line_open:
+                # 续写被拆开的名单
+                text = text.lstrip("、")
+        # 续写标题等到小节真正还有内容时才写出
+        text = self._continuation() + text
+        self._continue = False
+        self._chunks.append(text)
+        self._size += json_size(text)
+
+    def _new_part(self):
+        self.parts.append(self._chunks)
+        self._chunks = []
+        self._size = 0
+        self._continue = self._section is not None
+
+    def section(self, heading):
+        """开始一个小节"""
+        self._end_line()
+        # 标题本身写不下时下一条从这个标题开始，不需要“（续）”
+        self._section = None
+        self._continue = False
+        self._write(f"### {heading}\n")
+        self._section = heading
+
+    def line(self, text):
+        """写入一整行"""
+        self._end_line()
+        self._write(f"{text}\n")
+
+    def names(self, names):
+        """逐个写入名字，以顿号分隔；没有名字时写入“- 无”"""
+        empty = True
+        for name in names:
+            self._write(f"、{name}" if self._line_open else name)
+            self._line_open = True
+            empty = False
+        if empty:
+            self.line("- 无")
+        self._end_line()
+
+    def _end_line(self):
+        if self._line_open:
+            self._line_open = False
+            self._write("\n")
+
+    def build(self):
+        """返回按顺序发送的消息体列表"""
+        self._end_line()
+        # 最后一次拆分只丢下了行尾时没有剩余内容
+        parts = self.parts + [self._chunks] if self._chunks or not self.parts else self.parts
+        total = len(parts)
+        payloads = []
+        for i, chunks in enumerate(parts):
+            mark = f"（{i + 1}/{total}）" if total > 1 else ""
+            text = self._header(mark, i == 0) + "".join(chunks) + self.footer
+            payloads.append(self._payload(text, i == 0))
+        return payloads
+
+
+@traced('dingtalk.build_payloads')
+def build_payloads(process_name, at_name, new_finished, new_unfinished, finished, unfinished,
+                   counts_only=False, limit=MAX_MESSAGE_BYTES):
+    """构建打卡信息消息，超出大小上限时拆分为多条
+
+    counts_only 为 True 时当前名单只发送人数，只有新增人员列出名字。
+    """
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    builder = MarkdownBuilder(process_name, at_name, REPO_FOOTER + f"*{current_time}*\n", limit)
+    builder.section("新增已完成人员")
+    builder.names(new_finished)
+    builder.section("新增未完成人员")
+    builder.names(new_unfinished)
+    if counts_only:
+        builder.section("当前已完成人数")
+        builder.line(f"{len(finished)} 人")
+        builder.section("当前未完成人数")
+        builder.line(f"{len(unfinished)} 人")
+    else:
+        builder.section("当前已完成人员")
+        builder.names(finished)
+        builder.section("当前未完成人员")
+        builder.names(unfinished)
+    return builder.build()
+
+
+def resolve_targets(config, process):
+    """一个项目的推送目标 [{'name', 'webhook_url', 'secret'}]
+
+    项目 info 中的 targets 按名称引用 config.json 中 robots 配置的机器人，没有指定时使用设置中的
+    webhook_url / secret；robots 中 always 为 true 的（如审计机器人）总是加入。同一机器人只发送一次。
+    """
+    robots = {robot.get('name'): robot for robot in config.get('robots', [])}
+    candidates = []
+    for name in process['info'].get('targets', []):
+        if name in robots:
+            candidates.append(robots[name])
+        else:
+            print(f"DingTalk target {name} is not configured")
+    if not candidates:
+        candidates.append({'name': DEFAULT_TARGET, 'webhook_url': config.get('webhook_url', ''),
+                           'secret': config.get('secret', '')})
+    candidates += [robot for robot in robots.values() if robot.get('always')]
+
+    targets = []
+    seen = set()
+    for robot in candidates:
+        webhook_url = robot.get('webhook_url', '')
+        secret = robot.get('secret', '')
+        if not webhook_url or not secret or robot_of(webhook_url) in seen:
+            continue
+        seen.add(robot_of(webhook_url))
+        targets.append({'name': robot.get('name') or DEFAULT_TARGET, 'webhook_url': webhook_url, 'secret': secret})
+    return targets
+
+
+def secret_for(config, webhook_url):
+    """按 Webhook 地址在当前配置中查找加签密钥，未配置时返回空字符串"""
+    robots = config.get('robots', []) + [{'webhook_url': config.get('webhook_url', ''), 'secret': config.get('secret', '')}]
+    for robot in robots:
+        if robot.get('webhook_url') and robot_of(robot['webhook_url']) == robot_of(webhook_url):
+            return robot.get('secret', '')
+    return ''
+
+
+def queue_notification(config, process_name, process, new_finished, new_unfinished, outbox_dir=None):
+    """钉钉机器人开启时，将一次保存的结果排入各推送目标的发送队列，返回已排队的目标名称"""
+    if config.get('dingtalk_bot') != '开启':
+        return []
+    targets = resolve_targets(config, process)
+    if not targets:
+        return []
+    payloads = build_payloads(
+        process_name=process_name,
+        at_name=process['info'].get('at_name', []),
+        new_finished=sorted(new_finished),
+        new_unfinished=sorted(new_unfinished),
+        finished=process['finished'],
+        unfinished=process['unfinished'],
+        counts_only=config.get('dingtalk_counts_only') == '开启'
+    )
+    # 交给常驻发送器：同一目标按顺序发送，不同目标并发发送
+    dispatcher = get_dispatcher(outbox_dir or OUTBOX_DIR)
+    for target in targets:
+        for payload in payloads:
+            dispatcher.send(target['webhook_url'], payload, target['name'])
+    return [target['name'] for target in targets]
+
+
+class TokenBucket:
+    """令牌桶限流，默认对应钉钉每个机器人每分钟 20 条消息"""
+
+    def __init__(self, capacity=20, per_seconds=60.0):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def wait_time(self):
+        """取走一个令牌需要等待的秒数，为 0 时已取走"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """阻塞直到取得一个令牌"""
+        while True:
+            delay = self.wait_time()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+
+class Outbox:
+    """持久化的待发送消息
+
+    每条消息在发送前写成 outbox 目录下的一个 JSON 文件，收到 errcode == 0 后才删除，
+    程序重启后会重新加载尚未送达的消息。不能重试或重试次数用完的消息移到 dead 子目录，
+    不再阻塞同一机器人后面的消息。directory 为 None 时只保存在内存中。
+    记录中不保存加签密钥，发送时从当前配置读取，修改设置后不必清理 outbox。
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.dead_directory = None if directory is None else os.path.join(directory, 'dead')
+        self.entries = {}
+        # 不再重试的消息 {id: 消息}，带 error 字段
+        self.dead = {}
+        self._counter = itertools.count()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            for entry in self._load(directory):
+                # 重启后立即重试；旧版本写入的密钥不再保留
+                entry['next_try'] = 0
+                if entry.pop('secret', None) is not None:
+                    self._write(entry)
+                self.entries[entry['id']] = entry
+            self.dead = {entry['id']: entry for entry in self._load(self.dead_directory)}
+
+    @staticmethod
+    def _load(directory):
+        entries = []
+        try:
+            file_names = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            return entries
+        for file_name in file_names:
+            if not file_name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, file_name), 'r', encoding='utf-8') as f:
+                    entries.append(json.load(f))
+            except (OSError, json.JSONDecodeError):
+                continue
+        return entries
+
+    def add(self, webhook_url, payload, target=None):
+        """写入一条新消息，返回其 id"""
+        # id 按时间排序，保证发送顺序
+        entry_id = f"{time.time_ns():020d}-{next(self._counter):06d}"
+        entry = {
+            'id': entry_id,
+            'webhook_url': webhook_url,
+            'payload': payload,
+            'target': target or DEFAULT_TARGET,
+            'attempts': 0,
+            'next_try': 0
+        }
+        self._write(entry)
+        self.entries[entry_id] = entry
+        return entry_id
+
+    def retry_later(self, entry_id, delay):
+        """记录一次失败并安排下次重试时间"""
+        entry = self.entries[entry_id]
+        entry['attempts'] += 1
+        entry['next_try'] = time.time() + delay
+        self._write(entry)
+
+    def remove(self, entry_id):
+        """消息已送达，删除记录"""
+        self.entries.pop(entry_id, None)
+        if self.directory is not None:
+            try:
+                os.remove(self._path(entry_id))
+            except FileNotFoundError:
+                pass
+
+    def discard(self, entry_id, error):
+        """消息不再重试，移到 dead 子目录并记录原因"""
+        entry = self.entries.pop(entry_id)
+        entry['error'] = error
+        self.dead[entry_id] = entry
+        if self.directory is not None:
+            os.makedirs(self.dead_directory, exist_ok=True)
+            write_json_atomic(os.path.join(self.dead_directory, f"{entry_id}.json"), entry)
+            try:
+                os.remove(self._path(entry_id))
+            except FileNotFoundError:
+                pass
+
+    def revive(self):
+        """把不再重试的消息放回队列（如修改密钥后），返回放回的条数"""
+        dead, self.dead = self.dead, {}
+        for entry_id, entry in dead.items():
+            entry.pop('error', None)
+            entry['attempts'] = 0
+            entry['next_try'] = 0
+            self._write(entry)
+            self.entries[entry_id] = entry
+            if self.directory is not None:
+                try:
+                    os.remove(os.path.join(self.dead_directory, f"{entry_id}.json"))
+                except FileNotFoundError:
+                    pass
+        return len(dead)
+
+    def _path(self, entry_id):
+        return os.path.join(self.directory, f"{entry_id}.json")
+
+    def _write(self, entry):
+        if self.directory is not None:
+            write_json_atomic(self._path(entry['id']), entry)
+
+    def next_entry(self, busy=()):
+        """返回 (下一条该发送的消息, 需要等待的秒数)，跳过 busy 中正在发送的机器人
+
+        同一个机器人的消息严格按顺序发送，队首消息在退避期间其后的消息也等待。
+        """
+        heads = {}
+        for entry_id in sorted(self.entries):
+            entry = self.entries[entry_id]
+            heads.setdefault(robot_of(entry['webhook_url']), entry)
+        heads = [entry for robot, entry in heads.items() if robot not in busy]
+        if not heads:
+            return None, None
+        entry = min(heads, key=lambda e: (e['next_try'], e['id']))
+        return entry, max(0.0, entry['next_try'] - time.time())
+
+
+def robot_of(webhook_url):
+    """以 access_token 为止的地址作为机器人标识"""
+    return webhook_url.split('&', 1)[0]
+
+
+class DingTalkDispatcher:
+    """常驻的钉钉消息发送器
+
+    消息先写入 Outbox，再由固定数量的工作线程通过共享的连接池会话发送：同一机器人（Webhook 地址）
+    同时只有一个线程在发送，保证顺序；不同机器人并发发送，一次保存推送到多个群的总耗时接近最慢的一个。
+    每个机器人各有一个令牌桶限流。发送失败的消息按指数退避重试，只有钉钉返回 errcode == 0 后才从 Outbox 删除；
+    重试无用的错误（签名不匹配、消息过长等）或失败 max_attempts 次后移出队列，不阻塞后面的消息。
+    加签密钥在每次发送时由 load_config() 返回的配置按 Webhook 地址查找。
+    每次发送后以 on_result(推送目标, 失败原因或 None) 报告结果，在工作线程中调用。
+    """
+
+    def __init__(self, outbox_dir=None, load_config=dict, rate_limit=20, per_seconds=60.0, timeout=10,
+                 backoff_base=5.0, backoff_max=3600.0, max_attempts=12, workers=4, on_result=None):
+        self.load_config = load_config
+        self.rate_limit = rate_limit
+        self.per_seconds = per_seconds
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_attempts = max_attempts
+        self.on_result = on_result
+        self._cond = threading.Condition()
+        self._closing = False
+        self._outbox = Outbox(outbox_dir)
+        self._buckets = {}
+        # 正在发送的机器人
+        self._busy = set()
+        # 推送目标 -> {'sent', 'failed', 'last_error'}
+        self._results = {}
+        self._session = self._create_session(workers)
+        self._threads = [threading.Thread(target=self._run, name=f'DingTalkDispatcher-{i}', daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    @staticmethod
+    def _create_session(workers):
+        """连接池复用 TLS 连接，并对限流和服务端错误自动重试"""
+        # requests/urllib3 导入较慢，只在真正需要发送时导入
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        session = requests.Session()
+        retries = Retry(
+            total=3,
+            backoff_factor=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"]
+        )
+        size = max(4, workers)
+        adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size, max_retries=retries)
+        session.mount("https://", adapter)
+        # 便于对接本地的替身服务器
+        session.mount("http://", adapter)
+        session.headers.update({"Content-Type": "application/json; charset=utf-8"})
+        return session
+
+    def send(self, webhook_url, payload, target=None):
+        """将消息写入 Outbox 后立即返回，target 为报告结果时使用的目标名称"""
+        with self._cond:
+            self._outbox.add(webhook_url, payload, target)
+            self._cond.notify_all()
+
+    def pending(self):
+        """尚未送达的消息数"""
+        with self._cond:
+            return len(self._outbox.entries)
+
+    def dead(self):
+        """不再重试的消息数"""
+        with self._cond:
+            return len(self._outbox.dead)
+
+    def retry_dead(self):
+        """把不再重试的消息重新排队，返回条数"""
+        with self._cond:
+            count = self._outbox.revive()
+            self._cond.notify_all()
+            return count
+
+    def results(self):
+        """各推送目标的发送统计 {目标: {'sent', 'failed', 'last_error'}}"""
+        with self._cond:
+            return {target: dict(stats) for target, stats in self._results.items()}
+
+    def _bucket(self, webhook_url):
+        robot = robot_of(webhook_url)
+        if robot not in self._buckets:
+            self._buckets[robot] = TokenBucket(self.rate_limit, self.per_seconds)
+        return self._buckets[robot]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    entry, delay = self._outbox.next_entry(self._busy)
+                    if entry is not None and delay <= 0:
+                        break
+                    # 关闭时只发送已到时间的消息，其余留在磁盘上下次启动再发
+                    if self._closing:
+                        self._cond.notify_all()
+                        return
+                    self._cond.wait(delay)
+                robot = robot_of(entry['webhook_url'])
+                self._busy.add(robot)
+                bucket = self._bucket(entry['webhook_url'])
+
+            target = entry.get('target', DEFAULT_TARGET)
+            bucket.acquire()
+            secret = self._secret(entry['webhook_url'])
+            if secret:
+                error, retryable = self._post(entry['webhook_url'], secret, entry['payload'], target)
+            else:
+                error, retryable = "未配置加签密钥", False
+
+            with self._cond:
+                self._busy.discard(robot)
+                stats = self._results.setdefault(target, {'sent': 0, 'failed': 0, 'last_error': None})
+                if error is None:
+                    stats['sent'] += 1
+                    self._outbox.remove(entry['id'])
+                elif not retryable or entry['attempts'] + 1 >= self.max_attempts:
+                    error = f"{error}，已停止重试"
+                    stats['failed'] += 1
+                    stats['last_error'] = error
+                    print(f"DingTalk message {entry['id']} to {target} moved to dead letters: {error}")
+                    self._outbox.discard(entry['id'], error)
+                else:
+                    error = f"{error}，稍后重试"
+                    stats['failed'] += 1
+                    stats['last_error'] = error
+                    delay = min(self.backoff_max, self.backoff_base * 2 ** entry['attempts'])
+                    print(f"DingTalk message {entry['id']} to {target} will retry in {delay:.0f}s")
+                    self._outbox.retry_later(entry['id'], delay)
+                self._cond.notify_all()
+
+            if self.on_result is not None:
+                try:
+                    self.on_result(target, error)
+                except Exception as e:
+                    print(f"Failed to report DingTalk result: {str(e)}")
+
+    def _secret(self, webhook_url):
+        try:
+            return secret_for(self.load_config(), webhook_url)
+        except (OSError, ValueError) as e:
+            print(f"Failed to load DingTalk secret: {str(e)}")
+            return ''
+
+    def _post(self, webhook_url, secret, payload, target=DEFAULT_TARGET):
+        """签名并发送一条消息，返回 (失败原因或 None, 是否值得重试)"""
+        import requests
+        try:
+            # 签名带时间戳，必须在真正发送前生成
+            url = sign_url(webhook_url, secret)
+            # 只记录主机名，追踪文件中不带 access_token
+            with span('dingtalk.post', target=target, host=urllib.parse.urlsplit(webhook_url).netloc) as timing:
+                response = self._session.post(url, data=encode_payload(payload), timeout=self.timeout, verify=True)
+                timing.set(status=response.status_code)
+
+            # 先看状态码：服务端错误和限流值得重试，其余 4xx 重试也不会成功；错误页面不一定是 JSON
+            if response.status_code != 200:
+                print(f"DingTalk send to {target} failed: Status={response.status_code}, Response={response.text}")
+                retryable = response.status_code >= 500 or response.status_code == 429
+                return f"HTTP {response.status_code}", retryable
+            response_json = response.json()
+
+            # 检查响应，非零 errcode 中只有系统繁忙和限流值得重试
+            errcode = response_json.get("errcode")
+            if errcode != 0:
+                print(f"DingTalk send to {target} failed: Status={response.status_code}, Response={response.text}")
+                return response_json.get("errmsg") or f"errcode {errcode}", errcode in RETRYABLE_ERRCODES
+            print(f"DingTalk message sent to {target} successfully")
+            return None, False
+
+        except requests.exceptions.SSLError as ssl_err:
+            print(f"DingTalk SSL error: {str(ssl_err)}")
+            return str(ssl_err), True
+        except requests.exceptions.RequestException as req_err:
+            print(f"DingTalk request error: {str(req_err)}")
+            return str(req_err), True
+        except Exception as e:
+            print(f"DingTalk unexpected error: {str(e)}")
+            return str(e), True
+
+    def join(self, timeout=None):
+        """等待 Outbox 清空，返回是否已全部送达"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._outbox.entries:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=5.0):
+        """发送已到时间的消息后停止工作线程，不阻塞超过 timeout 秒"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        if not any(thread.is_alive() for thread in self._threads):
+            self._session.close()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+_on_result = None
+
+OUTBOX_DIR = './data/outbox'
+
+
+def get_dispatcher(outbox_dir=OUTBOX_DIR):
+    """返回进程内唯一的发送器，outbox_dir 只在首次创建时生效
+
+    加签密钥从与 outbox 同在 data 目录下的 config.json 读取。
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            config_file = os.path.join(os.path.dirname(os.path.abspath(outbox_dir)), 'config.json')
+
+            def load_config():
+                with open(config_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+
+            _dispatcher = DingTalkDispatcher(outbox_dir, load_config, on_result=_on_result)
+        return _dispatcher
+
+
+def set_result_callback(callback):
+    """设置发送结果回调 callback(推送目标, 失败原因或 None)，在发送线程中调用"""
+    global _on_result
+    with _dispatcher_lock:
+        _on_result = callback
+        if _dispatcher is not None:
+            _dispatcher.on_result = callback
+
+
+def resume_pending():
+    """上次运行留下未送达的消息时启动发送器"""
+    try:
+        has_pending = any(name.endswith('.json') for name in os.listdir(OUTBOX_DIR))
+    except FileNotFoundError:
+        has_pending = False
+    if has_pending:
+        get_dispatcher()
+
+
+def retry_dead_letters():
+    """修改设置后把不再重试的消息重新排队，没有时不启动发送器"""
+    try:
+        has_dead = any(name.endswith('.json') for name in os.listdir(os.path.join(OUTBOX_DIR, 'dead')))
+    except FileNotFoundError:
+        has_dead = False
+    if has_dead:
+        count = get_dispatcher().retry_dead()
+        print(f"Requeued {count} DingTalk messages")
+
+
+def shutdown_dispatcher():
+    """程序退出前尽量发送剩余消息，未送达的留在 Outbox 中"""
+    global _dispatcher
+    with _dispatcher_lock:
+        dispatcher, _dispatcher = _dispatcher, None
+    if dispatcher is not None:
+        dispatcher.close()
+
+
+class StandInServer:
+    """本地的钉钉替身服务器，记录收到的消息，用于在不访问钉钉的情况下测试发送"""
+
+    def __init__(self, host='127.0.0.1', port=0, response=None, delay=0.0):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.received = []
+        self.response = response or {"errcode": 0, "errmsg": "ok"}
+        # 模拟网络延迟（秒）
+        self.delay = delay
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                time.sleep(server.delay)
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                server.received.append({
+                    'path': self.path,
+                    'payload': json.loads(body.decode('utf-8'))
+                })
+                data = json.dumps(server.response).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def webhook_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/robot/send?access_token=stand-in"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+if __name__ == '__main__':
+    # 逐个字节上限检查拆分：508、509 时拆分正好落在“当前未完成人员”末尾的换行上，
+    # 不应再出现只有“（续）”标题的空小节
+    for limit in range(450, 2000):
+        payloads = build_payloads('测试', [], [f'n{i}' for i in range(9)], [], [f'm{i}' for i in range(15)],
+                                  [f'u{i}' for i in range(8)], limit=limit)
+        for payload in payloads:
+            text = payload['markdown']['text']
+            assert len(encode_payload(payload)) <= limit, limit
+            assert '（续）\n###' not in text and '（续）\n\n' not in text, (limit, text)
+    print("message splitting ok")
+
+    # 向三个各有 0.5 秒延迟的替身服务器推送，其中审计机器人返回错误，检查并发发送和逐目标结果
+    with StandInServer(delay=0.5) as class_group, StandInServer(delay=0.5) as teachers, \
+            StandInServer(delay=0.5, response={"errcode": 310000, "errmsg": "sign not match"}) as audit:
+        config = {
+            'dingtalk_bot': '开启',
+            'robots': [
+                {'name': '班级群', 'webhook_url': class_group.webhook_url, 'secret': 'class-secret'},
+                {'name': '教师群', 'webhook_url': teachers.webhook_url, 'secret': 'teachers-secret'},
+                {'name': '审计', 'webhook_url': audit.webhook_url, 'secret': 'audit-secret', 'always': True}
+            ]
+        }
+        process = {'info': {'at_name': [], 'targets': ['班级群', '教师群']}, 'finished': ['张三'], 'unfinished': []}
+        results = []
+        # 作为 queue_notification 使用的发送器，消息只保存在内存中
+        _dispatcher = DingTalkDispatcher(load_config=lambda: config,
+                                         on_result=lambda target, error: results.append((target, error)))
+        start = time.monotonic()
+        targets = queue_notification(config, '测试项目', process, ['张三'], [])
+        while len(results) < len(targets):
+            time.sleep(0.01)
+        print(f"sent to {len(targets)} targets in {time.monotonic() - start:.2f}s")
+        for target, error in results:
+            print(f"  {target}: {error or 'ok'}")
+        _dispatcher.close(timeout=1.0)
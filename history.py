@@ -0,0 +1,288 @@
+import os
+import threading
+import time
+from array import array
+from collections import namedtuple
+from datetime import datetime
+
+from storage import MemberTable, FileLock
+from tracing import traced
+
+
+# 一次状态变化：时间戳、项目名、人员名、是否变为已完成
+Event = namedtuple('Event', ['ts', 'process', 'member', 'finished'])
+
+# 列文件：列名 -> (文件名, array 类型)
+COLUMNS = {
+    'member': ('member.u32', 'I'),
+    'process': ('process.u32', 'I'),
+    'finished': ('finished.u8', 'B'),
+    'ts': ('ts.f64', 'd'),
+}
+
+
+def _month_of(ts):
+    return datetime.fromtimestamp(ts).strftime('%Y-%m')
+
+
+def _month_range(month):
+    """月份分段覆盖的时间戳范围 [start, end)"""
+    start = datetime.strptime(month, '%Y-%m')
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start.timestamp(), end.timestamp()
+
+
+class _Names:
+    """持久化的名字表，一行一个名字，行号即编号，只追加"""
+
+    def __init__(self, path):
+        self.path = path
+        self.table = MemberTable()
+        self._offset = 0
+        self.refresh()
+
+    def refresh(self):
+        """读入其他实例追加的名字"""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # 只读完整的行
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].decode('utf-8').split('\n')[:-1]:
+            self.table.id_of(line)
+        self._offset += end
+
+    def id_of(self, name):
+        """名字对应的编号，新名字先写入文件再分配"""
+        member_id = self.table.ids.get(name)
+        if member_id is None:
+            with open(self.path, 'ab') as f:
+                f.write((name + '\n').encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+            self.refresh()
+            member_id = self.table.ids[name]
+        return member_id
+
+    def get(self, name):
+        return self.table.ids.get(name)
+
+    def name(self, member_id):
+        return self.table.names[member_id]
+
+
+class _Segment:
+    """一个月的事件，每列一个定长二进制文件
+
+    首次查询时读入各列并建立 人员 -> 行号、项目 -> 行号 的索引，之后只读入新追加的行。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.month = os.path.basename(directory)
+        self.columns = None
+        self.by_member = None
+        self.by_process = None
+
+    def _path(self, column):
+        return os.path.join(self.directory, COLUMNS[column][0])
+
+    def load(self):
+        """读入尚未读取的行（包括其他实例追加的），需在历史锁内调用"""
+        if self.columns is None:
+            self.columns = {column: array(typecode) for column, (_, typecode) in COLUMNS.items()}
+            self.by_member = {}
+            self.by_process = {}
+        start = len(self.columns['ts'])
+        tails = {}
+        for column, values in self.columns.items():
+            try:
+                with open(self._path(column), 'rb') as f:
+                    f.seek(start * values.itemsize)
+                    tails[column] = f.read()
+            except FileNotFoundError:
+                tails[column] = None
+        # 写入中途崩溃时各列长度可能不同，以最短的一列为准并截断其余列
+        count = min(len(data or b'') // self.columns[column].itemsize for column, data in tails.items())
+        for column, data in tails.items():
+            values = self.columns[column]
+            values.frombytes(data[:count * values.itemsize] if data else b'')
+            if data is not None and len(data) != count * values.itemsize:
+                with open(self._path(column), 'r+b') as f:
+                    f.truncate((start + count) * values.itemsize)
+        for row in range(start, start + count):
+            self._index(row)
+
+    def _index(self, row):
+        member = self.columns['member'][row]
+        process = self.columns['process'][row]
+        if member not in self.by_member:
+            self.by_member[member] = array('I')
+        self.by_member[member].append(row)
+        if process not in self.by_process:
+            self.by_process[process] = array('I')
+        self.by_process[process].append(row)
+
+    def __len__(self):
+        self.load()
+        return len(self.columns['ts'])
+
+    def append(self, rows):
+        """追加若干行 (member, process, finished, ts)"""
+        self.load()
+        os.makedirs(self.directory, exist_ok=True)
+        start = len(self.columns['ts'])
+        for i, column in enumerate(COLUMNS):
+            values = array(COLUMNS[column][1], (row[i] for row in rows))
+            with open(self._path(column), 'ab') as f:
+                f.write(values.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.columns[column].extend(values)
+        for row in range(start, start + len(rows)):
+            self._index(row)
+
+    def rows(self, member=None, process=None):
+        """满足条件的行号，优先使用较短的索引"""
+        self.load()
+        if member is None and process is None:
+            return range(len(self.columns['ts']))
+        if process is None:
+            return self.by_member.get(member, ())
+        if member is None:
+            return self.by_process.get(process, ())
+        by_member = self.by_member.get(member, ())
+        by_process = self.by_process.get(process, ())
+        if len(by_member) <= len(by_process):
+            return [row for row in by_member if self.columns['process'][row] == process]
+        return [row for row in by_process if self.columns['member'][row] == member]
+
+
+class EventLog:
+    """打卡事件历史
+
+    每次保存中移动的人员记为一条事件（人员、项目、方向、时间），按月分段存放在
+    directory/YYYY-MM/ 下的列文件中，只追加。名字在 members.txt / processes.txt
+    中编号。按时间范围查询时跳过不相关的月份，按人员或项目查询时走段内索引，
+    不需要扫描全部历史。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # 多个站点共享 data 目录时，写入和查询都在这把锁内进行
+        self._lock = FileLock(os.path.join(directory, 'history.lock'))
+        self.members = _Names(os.path.join(directory, 'members.txt'))
+        self.processes = _Names(os.path.join(directory, 'processes.txt'))
+        self._segments = {}
+
+    def _refresh(self):
+        """读入其他实例新增的名字和月份，需在锁内调用"""
+        self.members.refresh()
+        self.processes.refresh()
+        for month in os.listdir(self.directory):
+            path = os.path.join(self.directory, month)
+            if month not in self._segments and os.path.isdir(path):
+                self._segments[month] = _Segment(path)
+
+    # ---------- 写入 ----------
+
+    @traced('history.record')
+    def record(self, process, new_finished, new_unfinished, ts=None):
+        """记录一次保存中移动的人员"""
+        if not new_finished and not new_unfinished:
+            return
+        if ts is None:
+            ts = time.time()
+        with self._lock:
+            self._refresh()
+            process_id = self.processes.id_of(process)
+            rows = [(self.members.id_of(member), process_id, 1, ts) for member in sorted(new_finished)]
+            rows += [(self.members.id_of(member), process_id, 0, ts) for member in sorted(new_unfinished)]
+            month = _month_of(ts)
+            segment = self._segments.get(month)
+            if segment is None:
+                segment = _Segment(os.path.join(self.directory, month))
+                self._segments[month] = segment
+            segment.append(rows)
+
+    # ---------- 查询 ----------
+
+    def _select(self, member=None, process=None, since=None, until=None):
+        """按条件返回事件，按时间先后排列"""
+        events = []
+        with self._lock:
+            self._refresh()
+            member_id = process_id = None
+            if member is not None:
+                member_id = self.members.get(member)
+                if member_id is None:
+                    return []
+            if process is not None:
+                process_id = self.processes.get(process)
+                if process_id is None:
+                    return []
+            for month in sorted(self._segments):
+                start, end = _month_range(month)
+                if (since is not None and end <= since) or (until is not None and start >= until):
+                    continue
+                segment = self._segments[month]
+                rows = segment.rows(member_id, process_id)
+                columns = segment.columns
+                for row in rows:
+                    ts = columns['ts'][row]
+                    if (since is not None and ts < since) or (until is not None and ts >= until):
+                        continue
+                    events.append(Event(ts, self.processes.name(columns['process'][row]),
+                                        self.members.name(columns['member'][row]),
+                                        bool(columns['finished'][row])))
+        events.sort(key=lambda event: event.ts)
+        return events
+
+    def member_events(self, member, process=None, since=None, until=None):
+        """某人的状态变化时间线，可限定项目和时间范围 [since, until)"""
+        return self._select(member=member, process=process, since=since, until=until)
+
+    def process_events(self, process, since=None, until=None):
+        """某项目的状态变化时间线"""
+        return self._select(process=process, since=since, until=until)
+
+    def events(self, since=None, until=None):
+        """时间范围内的全部事件"""
+        return self._select(since=since, until=until)
+
+    def completed_at(self, member, process):
+        """某人在某项目中最后一次被标记为已完成的时间，当前未完成时返回 None"""
+        events = self.member_events(member, process)
+        if events and events[-1].finished:
+            return events[-1].ts
+        return None
+
+    def completion_times(self, process):
+        """{人员: 完成时间}，只包含当前仍为已完成的人员"""
+        result = {}
+        for event in self.process_events(process):
+            if event.finished:
+                result[event.member] = event.ts
+            else:
+                result.pop(event.member, None)
+        return result
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def open_history(directory):
+    """按路径返回共享的事件历史实例"""
+    key = os.path.abspath(directory)
+    with _logs_lock:
+        if key not in _logs:
+            _logs[key] = EventLog(directory)
+        return _logs[key]
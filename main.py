@@ -1,128 +1,65 @@
+import time
+START_TIME = time.perf_counter()
+
 import sys
 import json
-import threading
-import time
-import hmac
-import hashlib
-import base64
-import urllib.parse
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from datetime import datetime
-from PyQt6.QtWidgets import (QApplication, QMainWindow, QLabel, QGridLayout,
-                             QWidget, QScrollArea, QMessageBox, QDialog)
-from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QFont
-from PyQt6.uic import loadUi
+from PyQt6.QtWidgets import QApplication, QMainWindow, QMessageBox, QDialog, QLabel
+from PyQt6.QtCore import QTimer, pyqtSignal
+from ui_loader import load_ui
+from roster import RosterModel, RosterFilter, RosterView
+from search import PrefixIndex
 from setting import SettingDialog
 from new_process import NewProcessDialog
 from process_manager import ProcessManagerDialog
+from storage import open_store, now_stamp, read_sync_server, read_sync_token
+from history import open_history
+from archive import open_archive
+from templates import open_templates
+from scheduler import TemplateScheduler
+from repository import ProcessRepository
+from dingtalk import queue_notification, resume_pending, retry_dead_letters, shutdown_dispatcher, set_result_callback
+from tracing import span, traced, enable as enable_tracing
 
 
-class DingTalkThread(threading.Thread):
-    def __init__(self, webhook_url, secret, process_name, at_name, new_finished, new_unfinished, finished, unfinished):
-        super().__init__()
-        self.webhook_url = webhook_url
-        self.secret = secret
-        self.process_name = process_name
-        self.at_name = at_name
-        self.new_finished = new_finished
-        self.new_unfinished = new_unfinished
-        self.finished = finished
-        self.unfinished = unfinished
-
-    def run(self):
-        try:
-            # Log webhook_url for debugging
-            print(f"Webhook URL: {self.webhook_url}")
-            print(f"Secret: {self.secret}")
-
-            # 生成时间戳和签名
-            timestamp = str(round(time.time() * 1000))
-            secret_enc = self.secret.encode('utf-8')
-            string_to_sign = f"{timestamp}\n{self.secret}"
-            string_to_sign_enc = string_to_sign.encode('utf-8')
-            hmac_code = hmac.new(secret_enc, string_to_sign_enc, digestmod=hashlib.sha256).digest()
-            sign = urllib.parse.quote_plus(base64.b64encode(hmac_code))
-
-            # 构造 Webhook URL（修复 ×tamp 为 timestamp）
-            url = f"{self.webhook_url}&timestamp={timestamp}&sign={sign}"
-            print(f"Constructed URL: {url}")
-
-            # 构建 Markdown 文本
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            at_name_text = "、".join([f"@{name}" for name in self.at_name]) or ""
-            new_finished_text = "、".join(self.new_finished) or "- 无"
-            new_unfinished_text = "、".join(self.new_unfinished) or "- 无"
-            finished_text = "、".join(self.finished) or "- 无"
-            unfinished_text = "、".join(self.unfinished) or "- 无"
-
-            markdown_text = (
-                f"## {self.process_name}{'' if not at_name_text else ' ' + at_name_text}\n"
-                f"### 新增已完成人员\n{new_finished_text}\n"
-                f"### 新增未完成人员\n{new_unfinished_text}\n"
-                f"### 当前已完成人员\n{finished_text}\n"
-                f"### 当前未完成人员\n{unfinished_text}\n"
-                f"\n------\n"
-                f"开源项目仓库 <https://github.com/Return-Log/Punch-Manager>\n"
-                f"*{current_time}*\n"
-            )
-
-            # 构造有效负载
-            payload = {
-                "msgtype": "markdown",
-                "markdown": {
-                    "title": "打卡信息",
-                    "text": markdown_text
-                },
-                "at": {
-                    "atMobiles": self.at_name,
-                    "isAtAll": False
-                }
-            }
-
-            # 配置重试会话
-            session = requests.Session()
-            retries = Retry(
-                total=3,
-                backoff_factor=1,
-                status_forcelist=[429, 500, 502, 503, 504],
-                allowed_methods=["POST"]
-            )
-            session.mount("https://", HTTPAdapter(max_retries=retries))
-
-            # 发送 POST 请求
-            headers = {"Content-Type": "application/json"}
-            response = session.post(url, json=payload, headers=headers, timeout=10, verify=True)
-            response_json = response.json()
-
-            # 检查响应
-            if response.status_code != 200 or response_json.get("errcode") != 0:
-                print(f"DingTalk send failed: Status={response.status_code}, Response={response.text}")
-            else:
-                print("DingTalk message sent successfully")
-
-        except requests.exceptions.SSLError as ssl_err:
-            print(f"DingTalk SSL error: {str(ssl_err)}")
-        except requests.exceptions.RequestException as req_err:
-            print(f"DingTalk request error: {str(req_err)}")
-        except Exception as e:
-            print(f"DingTalk unexpected error: {str(e)}")
+class MainWindow(QMainWindow):
+    # 没有任何项目时的提示
+    EMPTY_HINT = "当前没有项目，请新建项目"
+    # 启动时等待同步服务器首次同步的秒数
+    SYNC_TIMEOUT = 5
 
+    # 钉钉发送结果：推送目标, 失败原因或 None；从发送线程发出，在主线程处理
+    notificationResult = pyqtSignal(str, object)
 
-class MainWindow(QMainWindow):
+    @traced('window.create')
     def __init__(self):
         super().__init__()
-        loadUi('./ui/mainwindow.ui', self)
+        load_ui('mainwindow', self)
 
-        # 加载数据
+        # 加载数据，所有窗口共用同一个仓库
         self.data_file = './data/process.json'
         self.config_file = './data/config.json'
-        self.load_data()
+        sync_server = read_sync_server(self.config_file)
+        self.store = self.connect_sync_server(sync_server) if sync_server else None
+        remote = self.store is not None
+        if not remote:
+            self.store = open_store(self.data_file, self.config_file)
+        self.history = open_history('./data/history')
+        # 同步服务器模式下归档目录不共享，关闭的项目留在服务器数据中
+        archive = None if remote else open_archive('./data/archive')
+        self.repository = ProcessRepository(self.store, self, history=self.history, archive=archive)
+        # 快照损坏且无法完整恢复时，界面显示后提示（此时存储不再压缩日志）
+        degraded = getattr(self.store, 'degraded', None)
+        if degraded:
+            QTimer.singleShot(0, lambda: QMessageBox.warning(self, "数据恢复", degraded))
+        if remote:
+            # 其他站点的修改从同步线程经信号交给主线程应用
+            self.store.on_change = self.repository.remoteChanged.emit
+            self.repository.remoteChanged.emit(self.store.version(), None)
+        self.data = self.repository.processes
 
         # 当前项目
-        self.current_process = self.get_latest_process()
+        self.current_process = None
 
         # 本次运行的更改
         self.current_changes = {
@@ -130,150 +67,159 @@ class MainWindow(QMainWindow):
             'new_unfinished': set()
         }
 
+        # 名单视图
+        self.setup_roster_views()
+
         # 初始化布局
-        if self.current_process is None:
-            self.label_3.setText("## 无项目")
-            self.setup_scroll_areas_empty()
-        else:
-            self.label_3.setText(f"## {self.current_process}")
-            self.setup_scroll_areas()
+        self.show_process(self.get_latest_process())
 
         # 设置项目菜单
+        self.process_actions = {}
         self.setup_process_menu()
 
+        # 仓库变化时只更新受影响的部分
+        self.repository.processAdded.connect(self.on_process_added)
+        self.repository.processRemoved.connect(self.on_process_removed)
+        self.repository.modeChanged.connect(self.on_mode_changed)
+        self.repository.membersMoved.connect(self.on_members_moved)
+        self.repository.reloaded.connect(self.refresh_ui)
+        self.repository.saved.connect(self.on_saved)
+        self.repository.saveFailed.connect(self.on_save_failed)
+
+        # 状态栏右侧的保存状态
+        self.save_label = QLabel(self)
+        self.statusbar.addPermanentWidget(self.save_label)
+
+        # 最近一次保存的各推送目标状态：None 为发送中，其余为结果文字
+        self.notification_status = {}
+        self.notificationResult.connect(self.on_notification_result)
+        set_result_callback(self.notificationResult.emit)
+
+        # 按模板定时新建项目，所有模板共用一个定时器；错过的在启动后立即补建
+        self.templates = open_templates('./data/templates.json')
+        self.scheduler = TemplateScheduler(self.repository, self.templates, self)
+        self.scheduler.processCreated.connect(self.on_scheduled_process)
+        self.scheduler.reload()
+
+        # 对话框在首次打开时创建，之后重复使用
+        self.setting_dialog = None
+        self.new_process_dialog = None
+        self.process_manager_dialog = None
+        self.about_dialog = None
+        self.report_dialog = None
+        self.trace_dialog = None
+
         # 连接动作
         self.action1.triggered.connect(self.open_setting_dialog)
         self.action1_2.triggered.connect(self.open_about_dialog)
         self.action1_3.triggered.connect(self.open_new_process_dialog)
         self.action1_4.triggered.connect(self.open_process_manager_dialog)
+        self.action1_5.triggered.connect(self.open_report_dialog)
+        self.action1_6.triggered.connect(self.open_trace_dialog)
+
+    def connect_sync_server(self, address):
+        """连接同步服务器并等待首次同步，失败时提示并返回 None（改用本机数据）"""
+        # 只在配置了同步服务器时才导入网络相关模块
+        from sync import RemoteStore, parse_address
+        store = RemoteStore(*parse_address(address), token=read_sync_token(self.config_file))
+        if store.wait_ready(self.SYNC_TIMEOUT):
+            return store
+        store.close()
+        reason = f"（{store.error}）" if store.error else ""
+        QMessageBox.warning(self, "同步服务器", f"无法连接同步服务器 {address}{reason}，将使用本机数据")
+        return None
+
+    def has_unsaved_changes(self):
+        return bool(self.current_changes['new_finished'] or self.current_changes['new_unfinished'])
+
+    def confirm_unsaved_changes(self, closing=False):
+        """有未保存更改时询问保存或放弃，返回 False 表示取消操作；closing 为 True 时放弃不再恢复界面"""
+        if not self.has_unsaved_changes():
+            return True
+        reply = QMessageBox.question(
+            self, '未保存更改', f'项目 {self.current_process if self.current_process else "无项目"} 有未保存的更改，是否保存？',
+            QMessageBox.StandardButton.Save | QMessageBox.StandardButton.Discard | QMessageBox.StandardButton.Cancel
+        )
+        if reply == QMessageBox.StandardButton.Save:
+            self.save_data()
+        elif reply == QMessageBox.StandardButton.Discard:
+            if not closing:
+                # 恢复为仓库中已保存的状态
+                self.show_process(self.current_process)
+        else:
+            return False
+        return True
 
     def open_setting_dialog(self):
         """打开设置窗口前检查保存"""
-        if self.current_changes['new_finished'] or self.current_changes['new_unfinished']:
-            reply = QMessageBox.question(
-                self, '未保存更改', f'项目 {self.current_process if self.current_process else "无项目"} 有未保存的更改，是否保存？',
-                QMessageBox.StandardButton.Save | QMessageBox.StandardButton.Discard | QMessageBox.StandardButton.Cancel
-            )
-            if reply == QMessageBox.StandardButton.Save:
-                self.save_data()
-            elif reply == QMessageBox.StandardButton.Cancel:
-                return
+        if not self.confirm_unsaved_changes():
+            return
 
-        dialog = SettingDialog(self)
-        dialog.closed.connect(self.refresh_ui)
-        dialog.exec()
+        if self.setting_dialog is None:
+            with span('dialog.create', dialog='SettingDialog'):
+                self.setting_dialog = SettingDialog(self)
+        else:
+            self.setting_dialog.reload()
+        self.setting_dialog.exec()
+        # 密钥等可能已修正，之前放弃的消息重新发送
+        retry_dead_letters()
 
     def open_new_process_dialog(self):
         """打开新建项目窗口前检查保存"""
-        if self.current_changes['new_finished'] or self.current_changes['new_unfinished']:
-            reply = QMessageBox.question(
-                self, '未保存更改', f'项目 {self.current_process if self.current_process else "无项目"} 有未保存的更改，是否保存？',
-                QMessageBox.StandardButton.Save | QMessageBox.StandardButton.Discard | QMessageBox.StandardButton.Cancel
-            )
-            if reply == QMessageBox.StandardButton.Save:
-                self.save_data()
-            elif reply == QMessageBox.StandardButton.Cancel:
-                return
+        if not self.confirm_unsaved_changes():
+            return
 
-        dialog = NewProcessDialog(self)
-        dialog.closed.connect(self.refresh_ui)
-        dialog.exec()
+        if self.new_process_dialog is None:
+            with span('dialog.create', dialog='NewProcessDialog'):
+                self.new_process_dialog = NewProcessDialog(self.repository, self.templates, self)
+                self.new_process_dialog.templatesChanged.connect(self.scheduler.reload)
+        else:
+            self.new_process_dialog.reset()
+        self.new_process_dialog.exec()
 
     def open_process_manager_dialog(self):
         """打开项目管理窗口前检查保存"""
-        if self.current_changes['new_finished'] or self.current_changes['new_unfinished']:
-            reply = QMessageBox.question(
-                self, '未保存更改', f'项目 {self.current_process if self.current_process else "无项目"} 有未保存的更改，是否保存？',
-                QMessageBox.StandardButton.Save | QMessageBox.StandardButton.Discard | QMessageBox.StandardButton.Cancel
-            )
-            if reply == QMessageBox.StandardButton.Save:
-                self.save_data()
-            elif reply == QMessageBox.StandardButton.Cancel:
-                return
+        if not self.confirm_unsaved_changes():
+            return
 
-        dialog = ProcessManagerDialog(self)
-        dialog.updated.connect(self.refresh_ui)
-        dialog.exec()
+        if self.process_manager_dialog is None:
+            with span('dialog.create', dialog='ProcessManagerDialog'):
+                self.process_manager_dialog = ProcessManagerDialog(self.repository, self)
+        else:
+            self.process_manager_dialog.load_processes()
+        self.process_manager_dialog.exec()
 
+    @traced('ui.refresh')
     def refresh_ui(self):
-        """刷新主窗口界面"""
-        self.load_data()
-        old_process = self.current_process
-        self.current_process = self.get_latest_process()
+        """仓库整体重新加载后刷新主窗口界面，当前项目仍存在时继续显示它"""
+        self.data = self.repository.processes
+        if self.current_process in self.data:
+            # 保留尚未保存的更改，重新应用到最新名单上
+            changes = self.current_changes
+            self.show_process(self.current_process)
+            for name in changes['new_finished']:
+                if name in self.unfinished_model.names:
+                    self.label_clicked(name)
+            for name in changes['new_unfinished']:
+                if name in self.finished_model.names:
+                    self.label_clicked(name)
+        else:
+            self.show_process(self.get_latest_process())
+        self.setup_process_menu()
+
+    def show_process(self, process):
+        """显示指定项目，丢弃本次运行的更改；process 为 None 时显示空名单"""
+        self.current_process = process
         self.current_changes = {'new_finished': set(), 'new_unfinished': set()}
-        if self.current_process is None:
-            self.label_3.setText("## 无项目")
+        if process is None:
+            self.label_3.setText(f"## {self.EMPTY_HINT}" if not self.data else "## 无项目")
             self.setup_scroll_areas_empty()
         else:
-            self.label_3.setText(f"## {self.current_process}")
+            self.label_3.setText(f"## {process}")
             self.setup_scroll_areas()
-        self.setup_process_menu()
-
-    def load_data(self):
-        try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                self.data = json.load(f)
-            # 如果文件为空，初始化默认空项目
-            if not self.data:
-                self.data = {
-                    "当前没有项目，请新建项目": {
-                        "info": {
-                            "at_name": [],
-                            "create_time": "",
-                            "description": "",
-                            "mode": "on"
-                        },
-                        "unfinished": [],
-                        "finished": [],
-                        "change": {
-                            "new_finished": [],
-                            "new_unfinished": []
-                        },
-                        "update_time": ""
-                    }
-                }
-        except FileNotFoundError:
-            self.data = {
-                "当前没有项目，请新建项目": {
-                    "info": {
-                        "at_name": [],
-                        "create_time": "",
-                        "description": "",
-                        "mode": "on"
-                    },
-                    "unfinished": [],
-                    "finished": [],
-                    "change": {
-                        "new_finished": [],
-                        "new_unfinished": []
-                    },
-                    "update_time": ""
-                }
-            }
-        self.initial_states = {}
-        for process in self.data:
-            self.initial_states[process] = {
-                'unfinished': set(self.data[process]['unfinished']),
-                'finished': set(self.data[process]['finished'])
-            }
 
     def get_latest_process(self):
-        latest_time = None
-        latest_process = None
-        for process, data in self.data.items():
-            if data['info']['mode'] == 'on':
-                update_time = data.get('update_time', '')
-                if update_time:
-                    try:
-                        dt = datetime.strptime(update_time, "%Y-%m-%d %H:%M:%S")
-                        if latest_time is None or dt > latest_time:
-                            latest_time = dt
-                            latest_process = process
-                    except ValueError:
-                        continue
-                elif latest_process is None:
-                    latest_process = process
-        return latest_process  # 返回 None 如果没有有效项目
+        return self.repository.latest_process()  # 返回 None 如果没有有效项目
 
     def setup_process_menu(self):
         """清空 menu_2 后重新添加 action1_3, action1_4 和 mode: on 的项目"""
@@ -281,223 +227,293 @@ class MainWindow(QMainWindow):
         self.menu_2.addAction(self.action1_3)
         self.menu_2.addAction(self.action1_4)
         self.menu_2.addSeparator()
-        for process in self.data:
-            if self.data[process]['info']['mode'] == 'on':
-                action = self.menu_2.addAction(process)
-                action.triggered.connect(lambda checked, p=process: self.switch_process(p))
+        self.process_actions = {}
+        for process in self.repository.active_names():
+            self.add_process_action(process)
+
+    def add_process_action(self, process):
+        if process in self.process_actions:
+            return
+        action = self.menu_2.addAction(process)
+        action.triggered.connect(lambda checked, p=process: self.switch_process(p))
+        self.process_actions[process] = action
+
+    def remove_process_action(self, process):
+        action = self.process_actions.pop(process, None)
+        if action is not None:
+            self.menu_2.removeAction(action)
+            action.deleteLater()
+
+    def on_process_added(self, process):
+        """新建项目后切换到该项目；当前项目有未保存的更改时（如定时新建）只加入菜单"""
+        if self.data[process]['info']['mode'] == 'on':
+            self.add_process_action(process)
+            if not self.has_unsaved_changes():
+                self.show_process(process)
+
+    def on_scheduled_process(self, template, process):
+        self.statusbar.showMessage(f"已按模板 {template} 新建项目 {process}", 10000)
+
+    def on_process_removed(self, process):
+        self.remove_process_action(process)
+        if process == self.current_process:
+            self.show_process(self.get_latest_process())
+        elif self.current_process is None:
+            # 可能删除了最后一个项目，更新提示
+            self.show_process(None)
+
+    def on_mode_changed(self, process, mode):
+        if mode == 'on':
+            self.add_process_action(process)
+            if self.current_process is None:
+                self.show_process(self.get_latest_process())
+        else:
+            self.remove_process_action(process)
+            if process == self.current_process:
+                self.show_process(self.get_latest_process())
+
+    def on_members_moved(self, process, new_finished, new_unfinished):
+        """把其他来源的人员移动同步到当前名单，已在名单中的跳过
+
+        本机尚未保存的更改优先：与之相同的移动从 current_changes 中去掉，相反的移动不改变显示。
+        """
+        if process != self.current_process:
+            return
+        changes = self.current_changes
+        for name in new_finished:
+            if name in changes['new_finished']:
+                changes['new_finished'].discard(name)
+            elif name in self.unfinished_model.names and name not in changes['new_unfinished']:
+                self.unfinished_model.remove(name)
+                self.finished_model.append(name)
+        for name in new_unfinished:
+            if name in changes['new_unfinished']:
+                changes['new_unfinished'].discard(name)
+            elif name in self.finished_model.names and name not in changes['new_finished']:
+                self.finished_model.remove(name)
+                self.unfinished_model.append(name)
+        self.update_layouts()
 
     def switch_process(self, process):
         if process == self.current_process:
             return
 
-        if self.current_changes['new_finished'] or self.current_changes['new_unfinished']:
-            reply = QMessageBox.question(
-                self, '未保存更改', f'项目 {self.current_process if self.current_process else "无项目"} 有未保存的更改，是否保存？',
-                QMessageBox.StandardButton.Save | QMessageBox.StandardButton.Discard | QMessageBox.StandardButton.Cancel
-            )
-            if reply == QMessageBox.StandardButton.Save:
-                self.save_data()
-            elif reply == QMessageBox.StandardButton.Cancel:
-                return
+        if not self.confirm_unsaved_changes():
+            return
 
-        self.current_process = process
-        self.label_3.setText(f"## {process}")
-        self.current_changes = {'new_finished': set(), 'new_unfinished': set()}
-        self.setup_scroll_areas()
+        self.show_process(process)
 
+    @traced('ui.save')
     def save_data(self):
         if self.current_process is None:
             return  # 没有项目时不保存
-        self.data[self.current_process]['unfinished'] = [label.text() for label in self.unfinished_labels]
-        self.data[self.current_process]['finished'] = [label.text() for label in self.finished_labels]
-        self.data[self.current_process]['update_time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.data[self.current_process]['change']['new_finished'] = list(self.current_changes['new_finished'])
-        self.data[self.current_process]['change']['new_unfinished'] = list(self.current_changes['new_unfinished'])
-
-        with open(self.data_file, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
-
-        self.initial_states[self.current_process] = {
-            'unfinished': set(self.data[self.current_process]['unfinished']),
-            'finished': set(self.data[self.current_process]['finished'])
-        }
+        process = self.current_process
+        new_finished = self.current_changes['new_finished']
+        new_unfinished = self.current_changes['new_unfinished']
+
+        # 仓库立即应用到内存并发出 membersMoved，写入存储在后台进行，完成后发出 saved / saveFailed
+        update_time, update_ts = now_stamp()
+        moved = self.repository.punch_async(process, new_finished, new_unfinished, update_time, update_ts)
+        if moved is None:
+            QMessageBox.warning(self, "保存失败", f"项目 {process} 已被其他站点删除")
+            return
+
+        self.current_changes = {'new_finished': set(), 'new_unfinished': set()}
+        self.update_layouts()
+        self.show_save_state()
 
-        # 检查钉钉机器人是否开启并发送消息
+    def on_saved(self, process, new_finished, new_unfinished):
+        """后台写入完成后发送钉钉消息，人员为与其他站点合并后实际移动的"""
+        self.show_save_state()
+        if process not in self.data:
+            return
         try:
             with open(self.config_file, 'r', encoding='utf-8') as f:
                 config = json.load(f)
-            if config.get('dingtalk_bot') == '开启':
-                webhook_url = config.get('webhook_url', '')
-                secret = config.get('secret', '')
-                if webhook_url and secret:
-                    at_name = self.data[self.current_process]['info'].get('at_name', []) if self.current_process else []
-                    thread = DingTalkThread(
-                        webhook_url=webhook_url,
-                        secret=secret,
-                        process_name=self.current_process or "无项目",
-                        at_name=at_name,
-                        new_finished=self.current_changes['new_finished'],
-                        new_unfinished=self.current_changes['new_unfinished'],
-                        finished=self.data[self.current_process]['finished'] if self.current_process else [],
-                        unfinished=self.data[self.current_process]['unfinished'] if self.current_process else []
-                    )
-                    thread.start()
+            targets = queue_notification(config, process, self.data[process], new_finished, new_unfinished)
+            if targets:
+                self.notification_status = dict.fromkeys(targets)
+                self.show_notification_status()
         except Exception as e:
-            print(f"Failed to start DingTalk thread: {str(e)}")
-
-        self.current_changes = {'new_finished': set(), 'new_unfinished': set()}
+            print(f"Failed to queue DingTalk message: {str(e)}")
 
-    def closeEvent(self, event):
-        if self.current_changes['new_finished'] or self.current_changes['new_unfinished']:
-            reply = QMessageBox.question(
-                self, '未保存更改', f'项目 {self.current_process if self.current_process else "无项目"} 有未保存的更改，是否保存？',
-                QMessageBox.StandardButton.Save | QMessageBox.StandardButton.Discard | QMessageBox.StandardButton.Cancel
-            )
-            if reply == QMessageBox.StandardButton.Save:
-                self.save_data()
-                event.accept()
-            elif reply == QMessageBox.StandardButton.Discard:
-                event.accept()
-            else:
-                event.ignore()
+    def on_save_failed(self, process, new_finished, new_unfinished, error):
+        """保存失败（如同步服务器不可用）时把这些移动放回未保存的更改，仓库重新加载后重新显示"""
+        if process == self.current_process:
+            self.current_changes['new_finished'].update(new_finished)
+            self.current_changes['new_unfinished'].update(new_unfinished)
+        self.save_label.setText("保存失败")
+        # 等仓库处理完本批结果后再弹出
+        QTimer.singleShot(0, lambda: QMessageBox.warning(self, "保存失败", error))
+
+    def show_save_state(self):
+        if self.repository.pending_saves():
+            self.save_label.setText("保存中…")
         else:
-            event.accept()
+            self.save_label.setText(f"已保存 {datetime.now().strftime('%H:%M:%S')}")
 
-    def setup_scroll_areas(self):
-        self.unfinished_widget = QWidget()
-        self.finished_widget = QWidget()
-        self.unfinished_layout = QGridLayout()
-        self.finished_layout = QGridLayout()
-        self.unfinished_widget.setLayout(self.unfinished_layout)
-        self.finished_widget.setLayout(self.finished_layout)
-
-        self.scrollArea.setWidget(self.unfinished_widget)
-        self.scrollArea_2.setWidget(self.finished_widget)
-
-        self.unfinished_labels = []
-        self.finished_labels = []
-
-        for item in self.data[self.current_process]['unfinished']:
-            self.add_label(item, False)
+    def on_notification_result(self, target, error):
+        if target not in self.notification_status:
+            return
+        self.notification_status[target] = "已发送" if error is None else f"发送失败（{error}）"
+        self.show_notification_status()
 
-        for item in self.data[self.current_process]['finished']:
-            self.add_label(item, True)
+    def show_notification_status(self):
+        """在状态栏显示各推送目标的发送情况"""
+        parts = [f"{target} {status or '发送中'}" for target, status in self.notification_status.items()]
+        self.statusbar.showMessage(f"钉钉：{'，'.join(parts)}", 5000)
 
-        self.update_layouts()
+    def closeEvent(self, event):
+        if not self.confirm_unsaved_changes(closing=True):
+            event.ignore()
+            return
+        event.accept()
+        # 退出前等待后台写入完成
+        self.repository.flush()
+
+    def setup_roster_views(self):
+        """在两个滚动区域中放入名单视图，只绘制可见的人员"""
+        self.unfinished_model = RosterModel(
+            False, lambda name: name in self.current_changes['new_unfinished'], self)
+        self.finished_model = RosterModel(
+            True, lambda name: name in self.current_changes['new_finished'], self)
+        # 检索时只过滤显示，不重建视图
+        self.unfinished_filter = RosterFilter(self.unfinished_model, self)
+        self.finished_filter = RosterFilter(self.finished_model, self)
+        self.unfinished_view = RosterView(self.unfinished_filter)
+        self.finished_view = RosterView(self.finished_filter)
+        self.unfinished_view.nameClicked.connect(self.label_clicked)
+        self.finished_view.nameClicked.connect(self.label_clicked)
+        self.scrollArea.setWidget(self.unfinished_view)
+        self.scrollArea_2.setWidget(self.finished_view)
+
+        # 名字、拼音、首字母前缀索引，跨项目共用
+        self.search_index = PrefixIndex()
+        self.searchEdit.textChanged.connect(self.filter_rosters)
+        self.searchEdit.returnPressed.connect(self.punch_search_result)
+
+    @traced('ui.setup_scroll_areas')
+    def setup_scroll_areas(self):
+        self.unfinished_model.set_names(self.data[self.current_process]['unfinished'])
+        self.finished_model.set_names(self.data[self.current_process]['finished'])
+        self.search_index.update(self.data[self.current_process]['unfinished'])
+        self.search_index.update(self.data[self.current_process]['finished'])
+        self.filter_rosters(self.searchEdit.text())
 
     def setup_scroll_areas_empty(self):
         """设置空的滚动区域当没有项目时"""
-        self.unfinished_widget = QWidget()
-        self.finished_widget = QWidget()
-        self.unfinished_layout = QGridLayout()
-        self.finished_layout = QGridLayout()
-        self.unfinished_widget.setLayout(self.unfinished_layout)
-        self.finished_widget.setLayout(self.finished_layout)
-
-        self.scrollArea.setWidget(self.unfinished_widget)
-        self.scrollArea_2.setWidget(self.finished_widget)
-
-        self.unfinished_labels = []
-        self.finished_labels = []
-
-        self.update_layouts()
-
-    def add_label(self, text, is_finished):
-        label = QLabel(text)
-        label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-
-        # 设置更大的字体
-        font = QFont()
-        font.setPointSize(14)
-        label.setFont(font)
-
-        # 设置最小大小
-        label.setMinimumSize(100, 30)
-
-        # 应用初始样式
-        self._apply_label_style(label, text, is_finished)
-
-        label.mousePressEvent = lambda event: self.label_clicked(label)
-
-        if is_finished:
-            self.finished_labels.append(label)
-        else:
-            self.unfinished_labels.append(label)
-
-    def _apply_label_style(self, label, text, is_finished):
-        """根据完成状态和current_changes应用样式的帮助程序."""
-        if is_finished and text in self.current_changes['new_finished']:
-            label.setStyleSheet(
-                "background-color: rgba(0, 255, 0, 0.2); "
-                "border: 1px solid rgb(0, 255, 0); "
-                "padding: 5px; "
-                "margin: 2px;"
-            )
-        elif not is_finished and text in self.current_changes['new_unfinished']:
-            label.setStyleSheet(
-                "background-color: rgba(255, 255, 0, 0.2); "
-                "border: 1px solid rgb(255, 255, 0); "
-                "padding: 5px; "
-                "margin: 2px;"
-            )
-        else:
-            label.setStyleSheet(
-                "border: 1px solid rgb(128, 128, 128); "
-                "padding: 5px; "
-                "margin: 2px;"
-            )
-
-    def label_clicked(self, label):
-        text = label.text()
-        is_finished = label in self.finished_labels
+        self.unfinished_model.set_names([])
+        self.finished_model.set_names([])
+
+    @traced('ui.filter')
+    def filter_rosters(self, text):
+        """按输入的前缀过滤两列名单"""
+        visible = self.search_index.search(text) if text.strip() else None
+        self.unfinished_filter.set_visible(visible)
+        self.finished_filter.set_visible(visible)
+
+    def punch_search_result(self):
+        """检索结果在当前项目中唯一时，按点击同样的逻辑移动此人"""
+        text = self.searchEdit.text()
+        if self.current_process is None or not text.strip():
+            return
+        in_process = lambda name: name in self.unfinished_model.names or name in self.finished_model.names
+        matches = [name for name in self.search_index.search(text) if in_process(name)]
+        if len(matches) > 1:
+            # 有人与输入完全一致时（如输入“张三”或 zhangsan，同时还有“张三丰”）选他
+            matches = [name for name in self.search_index.exact(text) if in_process(name)] or matches
+        if len(matches) != 1:
+            self.statusbar.showMessage(f"匹配到 {len(matches)} 人，请继续输入", 3000)
+            return
+        self.label_clicked(matches[0])
+        self.statusbar.showMessage(f"{matches[0]} 已移动", 3000)
+        self.searchEdit.clear()
+
+    @traced('ui.label_clicked')
+    def label_clicked(self, text):
+        is_finished = text in self.finished_model.names
+        # 已保存的状态（位图，按成员编号查询）
+        saved = self.repository.status(self.current_process)
+        member_id = self.repository.members.id_of(text)
         if not is_finished:
-            self.unfinished_labels.remove(label)
-            self.finished_labels.append(label)
-            if text not in self.initial_states[self.current_process]['finished']:
+            self.unfinished_model.remove(text)
+            self.finished_model.append(text)
+            if member_id not in saved['finished']:
                 self.current_changes['new_finished'].add(text)
             self.current_changes['new_unfinished'].discard(text)
         else:
-            self.finished_labels.remove(label)
-            self.unfinished_labels.append(label)
-            if text not in self.initial_states[self.current_process]['unfinished']:
+            self.finished_model.remove(text)
+            self.unfinished_model.append(text)
+            if member_id not in saved['unfinished']:
                 self.current_changes['new_unfinished'].add(text)
             self.current_changes['new_finished'].discard(text)
 
-        # 立即更新标签样式
-        self._apply_label_style(label, text, not is_finished)
-
-        self.update_layouts()
-
+    @traced('ui.update_layouts')
     def update_layouts(self):
-        for i in reversed(range(self.unfinished_layout.count())):
-            self.unfinished_layout.itemAt(i).widget().setParent(None)
-        for i in reversed(range(self.finished_layout.count())):
-            self.finished_layout.itemAt(i).widget().setParent(None)
-
-        cols = 5
-        for i, label in enumerate(self.unfinished_labels):
-            row = i // cols
-            col = i % cols
-            self.unfinished_layout.addWidget(label, row, col)
-
-        for i, label in enumerate(self.finished_labels):
-            row = i // cols
-            col = i % cols
-            self.finished_layout.addWidget(label, row, col)
+        """current_changes 被重置后刷新两列的高亮状态"""
+        self.unfinished_model.refresh_states()
+        self.finished_model.refresh_states()
 
     def open_about_dialog(self):
         """打开关于窗口"""
-        dialog = AboutDialog(self)
-        dialog.exec()
+        if self.about_dialog is None:
+            with span('dialog.create', dialog='AboutDialog'):
+                self.about_dialog = AboutDialog(self)
+        self.about_dialog.exec()
+
+    def open_report_dialog(self):
+        """打开统计窗口，统计依赖 numpy，用到时才导入"""
+        if self.report_dialog is None:
+            try:
+                from report import ReportDialog
+            except ImportError as e:
+                QMessageBox.warning(self, "无法打开统计", f"统计功能需要安装 numpy：{str(e)}")
+                return
+            with span('dialog.create', dialog='ReportDialog'):
+                self.report_dialog = ReportDialog(self.repository, self)
+        else:
+            self.report_dialog.reload()
+        self.report_dialog.exec()
+
+    def open_trace_dialog(self):
+        """打开性能追踪面板"""
+        if self.trace_dialog is None:
+            from trace_panel import TraceDialog
+            self.trace_dialog = TraceDialog(self)
+        else:
+            self.trace_dialog.reload()
+        self.trace_dialog.exec()
 
 class AboutDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
-        loadUi('./ui/about.ui', self)
+        load_ui('about', self)
+
+
+def report_startup_time(imported, constructed):
+    """打印启动各阶段耗时（毫秒）并退出，用于跟踪冷启动性能"""
+    shown = time.perf_counter()
+    print(f"startup: imports={(imported - START_TIME) * 1000:.1f}ms "
+          f"window={(constructed - imported) * 1000:.1f}ms "
+          f"first_frame={(shown - constructed) * 1000:.1f}ms "
+          f"total={(shown - START_TIME) * 1000:.1f}ms")
+    QApplication.instance().quit()
 
 
 if __name__ == '__main__':
+    imported = time.perf_counter()
+    # python main.py --trace：从启动起记录性能追踪
+    if '--trace' in sys.argv:
+        enable_tracing()
     app = QApplication(sys.argv)
+    app.aboutToQuit.connect(shutdown_dispatcher)
     window = MainWindow()
     window.show()
-    sys.exit(app.exec())
\ No newline at end of file
+    constructed = time.perf_counter()
+    # python main.py --startup-time：显示第一帧后打印耗时并退出
+    if '--startup-time' in sys.argv:
+        QTimer.singleShot(0, lambda: report_startup_time(imported, constructed))
+    else:
+        # 继续发送上次未送达的消息
+        resume_pending()
+    sys.exit(app.exec())
@@ -1,40 +1,109 @@
 import json
 from datetime import datetime
-from PyQt6.QtWidgets import QDialog, QListWidgetItem, QMessageBox
+from PyQt6.QtWidgets import QDialog, QListWidgetItem, QMessageBox, QInputDialog
 from PyQt6.QtCore import pyqtSignal
-from PyQt6.uic import loadUi
+from ui_loader import load_ui
+from storage import now_stamp
+from templates import DEFAULT_TITLE, instance_title, next_run
 
 
 class NewProcessDialog(QDialog):
     # 信号：窗口关闭时通知主窗口刷新
     closed = pyqtSignal()
+    # 信号：模板新建、修改或删除后通知定时器重新排队
+    templatesChanged = pyqtSignal()
 
-    def __init__(self, parent=None):
+    NO_TEMPLATE = "（不使用模板）"
+
+    def __init__(self, repository, templates=None, parent=None):
         super().__init__(parent)
-        loadUi('./ui/new_process.ui', self)
+        load_ui('new_process', self)
 
         # 配置文件路径
         self.config_file = './data/config.json'
-        self.process_file = './data/process.json'
+        # 与主窗口共用的项目仓库
+        self.repository = repository
+        # 项目模板（TemplateStore），为 None 时不显示模板
+        self.templates = templates
 
         # 加载 config.json 中的名字
         self.load_config_names()
+        self.load_templates()
 
         # 连接信号
         self.connect_signals()
 
+    def reset(self):
+        """重复打开时清空输入并重新加载名单"""
+        self.lineEdit.clear()
+        self.lineEdit_2.clear()
+        self.lineEdit_3.clear()
+        self.lineEdit_4.clear()
+        self.lineEdit_5.clear()
+        self.listWidget.clear()
+        self.load_config_names()
+        self.load_templates()
+
     def load_config_names(self):
-        """加载 config.json 中的 name 到 listWidget_2"""
+        """加载 config.json 中的 name 到 listWidget_2，以及可选的推送群"""
         try:
             with open(self.config_file, 'r', encoding='utf-8') as f:
                 config = json.load(f)
                 names = config.get('name', [])
         except FileNotFoundError:
+            config = {}
             names = []
+        self.config_names = names
+
+        self.robot_names = [robot.get('name', '') for robot in config.get('robots', [])]
+        if self.robot_names:
+            self.lineEdit_4.setPlaceholderText(f"可选：{', '.join(self.robot_names)}；留空使用设置中的机器人")
+        else:
+            self.lineEdit_4.setPlaceholderText("未配置推送群，使用设置中的机器人")
 
         self.listWidget_2.clear()
-        for name in names:
-            self.listWidget_2.addItem(name)
+        self.listWidget_2.addItems(names)
+
+    def load_templates(self):
+        """加载模板名到 comboBox，第一项为不使用模板"""
+        templates = self.templates.load() if self.templates is not None else {}
+        self.comboBox.blockSignals(True)
+        self.comboBox.clear()
+        self.comboBox.addItem(self.NO_TEMPLATE)
+        self.comboBox.addItems(list(templates))
+        self.comboBox.blockSignals(False)
+        for widget in (self.label_8, self.comboBox, self.label_9, self.lineEdit_5, self.pushButton_3, self.pushButton_4):
+            widget.setVisible(self.templates is not None)
+
+    def current_template(self):
+        """comboBox 中选中的模板名，未选择时返回 None"""
+        if self.comboBox.currentIndex() <= 0:
+            return None
+        return self.comboBox.currentText()
+
+    def set_selected(self, names):
+        """整体设置已选名单，可选名单为 config.json 中其余的人；两列各重建一次，不逐项移动"""
+        selected = dict.fromkeys(names)
+        for widget in (self.listWidget, self.listWidget_2):
+            widget.setUpdatesEnabled(False)
+            widget.clear()
+        self.listWidget.addItems(list(selected))
+        self.listWidget_2.addItems([name for name in self.config_names if name not in selected])
+        for widget in (self.listWidget, self.listWidget_2):
+            widget.setUpdatesEnabled(True)
+
+    def apply_template(self, index):
+        """选择模板后填入各项，名称为模板名加今天的日期"""
+        name = self.current_template()
+        template = self.templates.get(name) if name is not None else None
+        if template is None:
+            return
+        self.lineEdit.setText(f"{name} {datetime.now().strftime(instance_title(template))}")
+        self.lineEdit_2.setText(template.get('description', ''))
+        self.lineEdit_3.setText(','.join(template.get('at_name', [])))
+        self.lineEdit_4.setText(','.join(template.get('targets', [])))
+        self.lineEdit_5.setText(template.get('schedule', ''))
+        self.set_selected(template.get('roster', []))
 
     def connect_signals(self):
         """连接控件信号"""
@@ -46,8 +115,13 @@ class NewProcessDialog(QDialog):
         self.pushButton.clicked.connect(self.move_all_to_listWidget)
         # pushButton_2 保存并关闭
         self.pushButton_2.clicked.connect(self.save_and_close)
+        # 模板：选择后填入，保存为模板，删除模板
+        self.comboBox.currentIndexChanged.connect(self.apply_template)
+        self.pushButton_3.clicked.connect(self.save_as_template)
+        self.pushButton_4.clicked.connect(self.delete_template)
         # lineEdit_3 中文逗号转英文逗号
         self.lineEdit_3.textEdited.connect(self.convert_commas)
+        self.lineEdit_4.textEdited.connect(self.convert_commas)
 
     def move_to_listWidget(self, item):
         """将 listWidget_2 的名字移到 listWidget"""
@@ -61,15 +135,15 @@ class NewProcessDialog(QDialog):
 
     def move_all_to_listWidget(self):
         """将 listWidget_2 所有名字移到 listWidget"""
-        while self.listWidget_2.count() > 0:
-            item = self.listWidget_2.takeItem(0)
-            self.listWidget.addItem(item.text())
+        names = [self.listWidget.item(i).text() for i in range(self.listWidget.count())]
+        names += [self.listWidget_2.item(i).text() for i in range(self.listWidget_2.count())]
+        self.set_selected(names)
 
     def convert_commas(self, text):
-        """将 lineEdit_3 中的中文逗号转为英文逗号"""
+        """将 lineEdit_3 / lineEdit_4 中的中文逗号转为英文逗号"""
         new_text = text.replace('，', ',')
         if new_text != text:
-            self.lineEdit_3.setText(new_text)
+            self.sender().setText(new_text)
 
     def save_and_close(self):
         """保存新项目并关闭窗口"""
@@ -80,25 +154,20 @@ class NewProcessDialog(QDialog):
             return
 
         # 检查是否已存在
-        try:
-            with open(self.process_file, 'r', encoding='utf-8') as f:
-                processes = json.load(f)
-        except FileNotFoundError:
-            processes = {}
-
-        if process_name in processes:
+        if self.repository.has(process_name) or process_name in self.repository.archived():
             QMessageBox.warning(self, "错误", f"项目 {process_name} 已存在")
             return
 
         # 获取当前时间
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        current_time, current_ts = now_stamp()
 
         # 获取 unfinished 列表
-        unfinished = [self.listWidget.item(i).text() for i in range(self.listWidget.count())]
+        unfinished = self.selected_names()
 
-        # 获取 at_name，分割并清理
-        at_name_text = self.lineEdit_3.text().strip()
-        at_name = [name.strip() for name in at_name_text.split(',') if name.strip()] if at_name_text else []
+        at_name = self.at_names()
+        targets = self.targets()
+        if targets is None:
+            return
 
         # 创建新项目
         new_process = {
@@ -114,20 +183,97 @@ class NewProcessDialog(QDialog):
                 "new_finished": [],
                 "new_unfinished": []
             },
-            "update_time": current_time
+            "update_time": current_time,
+            "update_ts": current_ts
         }
 
-        # 追加到 processes
-        processes[process_name] = new_process
+        if targets:
+            new_process['info']['targets'] = targets
 
-        # 保存到 process.json
-        with open(self.process_file, 'w', encoding='utf-8') as f:
-            json.dump(processes, f, ensure_ascii=False, indent=2)
+        # 写入仓库，主窗口收到 processAdded 后切换到新项目
+        try:
+            added = self.repository.add_process(process_name, new_process)
+        except ConnectionError as e:
+            QMessageBox.warning(self, "错误", str(e))
+            return
+        if not added:
+            QMessageBox.warning(self, "错误", f"项目 {process_name} 已被其他站点建立")
+            return
 
         # 发出关闭信号
         self.closed.emit()
         self.accept()
 
+    def selected_names(self):
+        return [self.listWidget.item(i).text() for i in range(self.listWidget.count())]
+
+    def at_names(self):
+        """获取 at_name，分割并清理"""
+        at_name_text = self.lineEdit_3.text().strip()
+        return [name.strip() for name in at_name_text.split(',') if name.strip()] if at_name_text else []
+
+    def targets(self):
+        """获取推送群，必须是 config.json 中 robots 里配置过的名称；有未配置的名称时提示并返回 None"""
+        targets = [name.strip() for name in self.lineEdit_4.text().split(',') if name.strip()]
+        unknown = [name for name in targets if name not in self.robot_names]
+        if unknown:
+            QMessageBox.warning(self, "错误", f"未配置的推送群：{', '.join(unknown)}")
+            return None
+        return targets
+
+    def save_as_template(self):
+        """把当前填写的内容保存为模板，填写了定时则按时自动新建项目"""
+        default = self.current_template() or self.lineEdit.text().strip()
+        name, ok = QInputDialog.getText(self, "保存为模板", "模板名称：", text=default)
+        name = name.strip()
+        if not ok or not name:
+            return
+
+        targets = self.targets()
+        if targets is None:
+            return
+        schedule = self.lineEdit_5.text().strip()
+        old = self.templates.get(name) or {}
+        template = {
+            "description": self.lineEdit_2.text().strip(),
+            "at_name": self.at_names(),
+            "targets": targets,
+            "roster": self.selected_names(),
+            "schedule": schedule,
+            # 留空时按定时决定是否带上时刻；以前保存的默认格式也改为留空
+            "title": '' if old.get('title') == DEFAULT_TITLE else old.get('title', '')
+        }
+        try:
+            self.templates.save(name, template)
+        except ValueError as e:
+            QMessageBox.warning(self, "错误", str(e))
+            return
+
+        self.load_templates()
+        self.comboBox.blockSignals(True)
+        self.comboBox.setCurrentText(name)
+        self.comboBox.blockSignals(False)
+        self.templatesChanged.emit()
+        if schedule:
+            when = next_run(self.templates.get(name))
+            QMessageBox.information(self, "已保存模板", f"模板 {name} 下一次将在 {when:%Y-%m-%d %H:%M} 自动新建项目")
+
+    def delete_template(self):
+        name = self.current_template()
+        if name is None:
+            QMessageBox.warning(self, "警告", "请先选择一个模板")
+            return
+        reply = QMessageBox.question(
+            self, "确认删除", f"是否删除模板 {name}？已建立的项目不受影响。",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+            QMessageBox.StandardButton.No
+        )
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        self.templates.delete(name)
+        self.load_templates()
+        self.templatesChanged.emit()
+
     def closeEvent(self, event):
         """窗口关闭时发出信号"""
         self.closed.emit()
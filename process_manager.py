@@ -1,19 +1,99 @@
-import json
-from PyQt6.QtWidgets import QDialog, QMessageBox
-from PyQt6.QtCore import pyqtSignal
-from PyQt6.uic import loadUi
+from PyQt6.QtWidgets import QDialog, QMessageBox, QAbstractItemView
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, pyqtSignal
+from ui_loader import load_ui
+
+
+# 自定义数据角色：项目名、mode、是否已归档
+NAME_ROLE = Qt.ItemDataRole.UserRole + 1
+MODE_ROLE = Qt.ItemDataRole.UserRole + 2
+ARCHIVED_ROLE = Qt.ItemDataRole.UserRole + 3
+
+
+class ProcessListModel(QAbstractListModel):
+    """项目列表，按筛选文字过滤后分批交给视图
+
+    条目只是 (项目名, mode, 是否已归档)，不含名单；视图滚动到底部时再取下一批，
+    几千个项目打开时也只创建可见部分的行。
+    """
+
+    BATCH = 200
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.entries = []
+        self.text = ''
+        self.rows = []
+        self.loaded = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.loaded
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        name, mode, archived = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f"{name} ({mode}, 已归档)" if archived else f"{name} ({mode})"
+        if role == NAME_ROLE:
+            return name
+        if role == MODE_ROLE:
+            return mode
+        if role == ARCHIVED_ROLE:
+            return archived
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.loaded < len(self.rows)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        count = min(self.BATCH, len(self.rows) - self.loaded)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.loaded, self.loaded + count - 1)
+        self.loaded += count
+        self.endInsertRows()
+
+    def fetch_all(self):
+        """一次取出全部筛选结果（全选前）"""
+        if self.loaded < len(self.rows):
+            self.beginInsertRows(QModelIndex(), self.loaded, len(self.rows) - 1)
+            self.loaded = len(self.rows)
+            self.endInsertRows()
+
+    def set_entries(self, entries):
+        """整体替换条目，保留筛选文字"""
+        self.entries = entries
+        self.set_filter(self.text)
+
+    def set_filter(self, text):
+        """只保留名称包含 text 的项目，从第一批重新开始"""
+        self.beginResetModel()
+        self.text = text
+        self.rows = [entry for entry in self.entries if text in entry[0]] if text else self.entries
+        self.loaded = min(self.BATCH, len(self.rows))
+        self.endResetModel()
 
 
 class ProcessManagerDialog(QDialog):
-    # 信号：mode 更改后通知主窗口刷新
+    # 信号：一次批量操作完成或窗口关闭后发出（主窗口直接监听仓库信号）
     updated = pyqtSignal()
 
-    def __init__(self, parent=None):
+    def __init__(self, repository, parent=None):
         super().__init__(parent)
-        loadUi('./ui/process_manager.ui', self)
+        load_ui('process_manager', self)
+
+        # 与主窗口共用的项目仓库
+        self.repository = repository
 
-        # process.json 路径
-        self.process_file = './data/process.json'
+        self.model = ProcessListModel(self)
+        self.listView.setModel(self.model)
+        self.listView.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.listView.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.listView.setUniformItemSizes(True)
 
         # 加载项目列表
         self.load_processes()
@@ -22,77 +102,109 @@ class ProcessManagerDialog(QDialog):
         self.connect_signals()
 
     def load_processes(self):
-        """加载 process.json 中的项目到 listWidget"""
-        try:
-            with open(self.process_file, 'r', encoding='utf-8') as f:
-                self.processes = json.load(f)
-        except FileNotFoundError:
-            self.processes = {}
-
-        self.listWidget.clear()
-        for process_name, data in self.processes.items():
-            mode = data['info']['mode']
-            item_text = f"{process_name} ({mode})"
-            self.listWidget.addItem(item_text)
+        """从仓库读取项目列表，归档的项目只读取索引"""
+        entries = [(name, data['info']['mode'], False) for name, data in self.repository.processes.items()]
+        entries += [(name, meta['mode'], True) for name, meta in self.repository.archived().items()]
+        self.model.set_entries(entries)
+        self.update_label()
+
+    def update_label(self):
+        total = len(self.model.entries)
+        shown = len(self.model.rows)
+        selected = len(self.listView.selectionModel().selectedRows())
+        text = f"共 {total} 个项目" if shown == total else f"筛选出 {shown} / {total} 个项目"
+        self.label.setText(f"{text}，已选 {selected} 个" if selected else text)
 
     def connect_signals(self):
-        """连接 listWidget 和 pushButton 信号"""
-        self.listWidget.itemClicked.connect(self.toggle_mode)
+        """连接筛选框、列表和按钮信号"""
+        self.lineEdit.textChanged.connect(self.filter)
+        self.listView.doubleClicked.connect(self.toggle_mode)
+        self.listView.selectionModel().selectionChanged.connect(self.update_label)
+        self.pushButton_4.clicked.connect(self.select_all)
+        self.pushButton_2.clicked.connect(self.enable_selected)
+        self.pushButton_3.clicked.connect(self.disable_selected)
         self.pushButton.clicked.connect(self.delete_selected_process)
 
-    def toggle_mode(self, item):
-        """切换项目 mode 状态并保存"""
-        # 提取项目名称（去除 (on/off) 部分）
-        process_name = item.text().split(' (')[0]
-
-        # 切换 mode
-        current_mode = self.processes[process_name]['info']['mode']
-        new_mode = "off" if current_mode == "on" else "on"
-        self.processes[process_name]['info']['mode'] = new_mode
-
-        # 更新 listWidget 显示
-        item.setText(f"{process_name} ({new_mode})")
-
-        # 保存到 process.json
-        with open(self.process_file, 'w', encoding='utf-8') as f:
-            json.dump(self.processes, f, ensure_ascii=False, indent=2)
-
-        # 发出更新信号
+    def filter(self, text):
+        self.model.set_filter(text.strip())
+        self.update_label()
+
+    def select_all(self):
+        """选中全部筛选结果"""
+        self.model.fetch_all()
+        self.listView.selectAll()
+
+    def selected(self):
+        """选中的项目 [(项目名, mode, 是否已归档)]"""
+        return [(index.data(NAME_ROLE), index.data(MODE_ROLE), index.data(ARCHIVED_ROLE))
+                for index in self.listView.selectionModel().selectedRows()]
+
+    def toggle_mode(self, index):
+        """双击切换单个项目：开启的关闭，关闭或归档的开启"""
+        entry = (index.data(NAME_ROLE), index.data(MODE_ROLE), index.data(ARCHIVED_ROLE))
+        if entry[1] == "on" and not entry[2]:
+            self.disable([entry])
+        else:
+            self.enable([entry])
+
+    def enable_selected(self):
+        self.enable(self.selected())
+
+    def disable_selected(self):
+        self.disable(self.selected())
+
+    def enable(self, entries):
+        """开启项目，归档的项目解压后放回，全部在一次写入中完成"""
+        names = [name for name, mode, archived in entries if archived or mode != "on"]
+        if not names:
+            return
+        self.apply(lambda: self.repository.enable_processes(names))
+
+    def disable(self, entries):
+        """关闭项目并移入归档（未启用归档时只改 mode），全部在一次写入中完成"""
+        if self.repository.archive is not None:
+            # 以前留在 process.json 中的已关闭项目也一并归档
+            names = [name for name, mode, archived in entries if not archived]
+            if names:
+                self.apply(lambda: self.repository.archive_processes(names))
+        else:
+            names = [name for name, mode, archived in entries if mode == "on"]
+            if names:
+                self.apply(lambda: self.repository.set_modes(names, "off"))
+
+    def apply(self, action):
+        """执行一次批量修改，然后重新读取列表并发出一次 updated"""
+        try:
+            action()
+        except ConnectionError as e:
+            QMessageBox.warning(self, "错误", str(e))
+            return
+        self.load_processes()
         self.updated.emit()
 
     def delete_selected_process(self):
         """删除选中的项目"""
-        selected_items = self.listWidget.selectedItems()
-        if not selected_items:
+        entries = self.selected()
+        if not entries:
             QMessageBox.warning(self, "警告", "请先选择一个项目")
             return
 
-        # 获取选中项目名称
-        selected_item = selected_items[0]
-        process_name = selected_item.text().split(' (')[0]
-
         # 弹出确认对话框
+        text = entries[0][0] if len(entries) == 1 else f"{entries[0][0]} 等 {len(entries)} 个项目"
         reply = QMessageBox.question(
-            self, "确认删除", f"是否删除选中项 {process_name}？",
+            self, "确认删除", f"是否删除选中项 {text}？",
             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
             QMessageBox.StandardButton.No
         )
+        if reply != QMessageBox.StandardButton.Yes:
+            return
 
-        if reply == QMessageBox.StandardButton.Yes:
-            # 从 processes 中删除
-            del self.processes[process_name]
-
-            # 保存到 process.json
-            with open(self.process_file, 'w', encoding='utf-8') as f:
-                json.dump(self.processes, f, ensure_ascii=False, indent=2)
-
-            # 更新 listWidget
-            self.listWidget.takeItem(self.listWidget.row(selected_item))
-
-            # 发出更新信号
-            self.updated.emit()
+        # 热数据中的项目一次写入删除，归档的项目只改一次索引
+        hot = [name for name, mode, archived in entries if not archived]
+        cold = [name for name, mode, archived in entries if archived]
+        self.apply(lambda: (self.repository.delete_processes(hot), self.repository.delete_archived(cold)))
 
     def closeEvent(self, event):
         """窗口关闭时发出信号"""
         self.updated.emit()
-        super().closeEvent(event)
\ No newline at end of file
+        super().closeEvent(event)
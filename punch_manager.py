@@ -0,0 +1,331 @@
+"""无界面的命令行入口，不导入 PyQt6
+
+    python -m punch_manager list
+    python -m punch_manager status -p 项目名 --names
+    python -m punch_manager punch -p 项目名 finished ids.txt
+    cat ids.txt | python -m punch_manager punch unfinished -
+    python -m punch_manager history -p 项目名 -m 人员名
+    python -m punch_manager report --out ./report
+    python -m punch_manager archive
+    python -m punch_manager template list
+    python -m punch_manager schedule
+    python -m punch_manager serve --port 8765
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+from storage import open_store, latest_process, apply_punch, now_stamp, TIME_FORMAT
+from history import open_history
+from archive import open_archive
+from templates import open_templates, create_due, next_run
+
+
+def read_config(config_file):
+    try:
+        with open(config_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def resolve_process(data, name):
+    """未指定项目时使用最近更新的进行中项目"""
+    if name is None:
+        name = latest_process(data)
+        if name is None:
+            raise SystemExit("没有进行中的项目，请用 -p 指定")
+    if name not in data:
+        raise SystemExit(f"项目 {name} 不存在")
+    return name
+
+
+def read_names(source):
+    """从文件或标准输入读取名字，每行一个，忽略空行"""
+    if source == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(source, 'r', encoding='utf-8-sig') as f:
+            lines = f.read().splitlines()
+    return list(dict.fromkeys(line.strip() for line in lines if line.strip()))
+
+
+def archive_dir(args):
+    return os.path.join(args.data_dir, 'archive')
+
+
+def cmd_list(args, store, config):
+    data = store.load()
+    for name, process in data.items():
+        mode = process['info']['mode']
+        if mode != 'on' and not args.all:
+            continue
+        print(f"{name}\t{mode}\t已完成 {len(process['finished'])}\t"
+              f"未完成 {len(process['unfinished'])}\t{process.get('update_time', '')}")
+    if args.all:
+        # 归档的项目只读取索引
+        for name, meta in open_archive(archive_dir(args)).index().items():
+            if name not in data:
+                print(f"{name}\t已归档\t已完成 {meta['finished']}\t"
+                      f"未完成 {meta['unfinished']}\t{meta['update_time']}")
+    return 0
+
+
+def cmd_status(args, store, config):
+    data = store.load()
+    if args.process is not None and args.process not in data:
+        # 查看归档的项目时解压其所在分段
+        process = open_archive(archive_dir(args)).get(args.process)
+        if process is not None:
+            data = {args.process: process}
+    name = resolve_process(data, args.process)
+    process = data[name]
+    print(f"## {name}")
+    print(f"已完成：{len(process['finished'])}  未完成：{len(process['unfinished'])}  "
+          f"更新时间：{process.get('update_time', '')}")
+    if args.names:
+        print("### 已完成")
+        print("\n".join(process['finished']) or "- 无")
+        print("### 未完成")
+        print("\n".join(process['unfinished']) or "- 无")
+    return 0
+
+
+def cmd_punch(args, store, config):
+    names = read_names(args.source)
+    # 读取和写入在同一把存储锁内，其他站点的写入不会在两者之间插入
+    with store.locked():
+        data = store.load()
+        name = resolve_process(data, args.process)
+        process = data[name]
+
+        # 与主窗口一致：只有状态真正改变的人才计入本次更改
+        source_list = 'unfinished' if args.status == 'finished' else 'finished'
+        movable = set(process[source_list])
+        moved = [n for n in names if n in movable]
+        already = set(process[args.status])
+        unknown = [n for n in names if n not in movable and n not in already]
+        for n in unknown:
+            print(f"不在项目名单中：{n}", file=sys.stderr)
+
+        new_finished = moved if args.status == 'finished' else []
+        new_unfinished = moved if args.status == 'unfinished' else []
+        print(f"{name}：{len(moved)} 人标记为{'已完成' if args.status == 'finished' else '未完成'}，"
+              f"{len(names) - len(moved) - len(unknown)} 人无需更改，{len(unknown)} 人不在名单中")
+        if not moved or args.dry_run:
+            return 1 if unknown else 0
+
+        update_time, update_ts = now_stamp()
+        store.punch(name, new_finished, new_unfinished, update_time, update_ts)
+    open_history(os.path.join(args.data_dir, 'history')).record(name, new_finished, new_unfinished, update_ts)
+
+    if not args.no_notify and config.get('dingtalk_bot') == '开启':
+        # 只在需要发送时才导入网络相关模块
+        from dingtalk import queue_notification, get_dispatcher, shutdown_dispatcher
+        apply_punch(process, new_finished, new_unfinished, update_time, update_ts)
+        outbox_dir = os.path.join(args.data_dir, 'outbox')
+        dead = get_dispatcher(outbox_dir).dead()
+        if queue_notification(config, name, process, new_finished, new_unfinished, outbox_dir):
+            dispatcher = get_dispatcher()
+            if not dispatcher.join(args.timeout):
+                print("钉钉消息未能全部送达，已保留在 outbox 中，下次启动时重试", file=sys.stderr)
+            if dispatcher.dead() > dead:
+                print("部分钉钉消息无法发送（如密钥错误），已移到 outbox/dead 中", file=sys.stderr)
+            shutdown_dispatcher()
+    return 1 if unknown else 0
+
+
+def parse_time(text):
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无法解析的时间：{text}")
+
+
+def cmd_history(args, store, config):
+    history = open_history(os.path.join(args.data_dir, 'history'))
+    if args.member is not None:
+        events = history.member_events(args.member, args.process, args.since, args.until)
+    elif args.process is not None:
+        events = history.process_events(args.process, args.since, args.until)
+    else:
+        events = history.events(args.since, args.until)
+    for event in events:
+        print(f"{datetime.fromtimestamp(event.ts).strftime(TIME_FORMAT)}\t{event.process}\t"
+              f"{event.member}\t{'已完成' if event.finished else '未完成'}")
+    return 0
+
+
+def cmd_report(args, store, config):
+    # 统计依赖 numpy，只在此命令中导入
+    from analytics import StatusMatrix, export_csv
+    data = open_archive(archive_dir(args)).load_all()
+    data.update(store.load())
+    matrix = StatusMatrix(data)
+    for path in export_csv(matrix, args.out):
+        print(path)
+    never = matrix.never_completed()
+    if never:
+        print(f"从未完成：{'、'.join(never)}")
+    return 0
+
+
+def cmd_archive(args, store, config):
+    archive = open_archive(archive_dir(args))
+    with store.locked():
+        data = store.load()
+        names = args.process or [name for name, process in data.items() if process['info']['mode'] == 'off']
+        processes = {}
+        for name in names:
+            if name not in data:
+                print(f"项目 {name} 不存在", file=sys.stderr)
+            elif data[name]['info']['mode'] == 'on' and not args.force:
+                print(f"项目 {name} 进行中，跳过（--force 强制归档）", file=sys.stderr)
+            else:
+                processes[name] = dict(data[name], info=dict(data[name]['info'], mode='off'))
+        # 先写入归档再从热数据中删除，全部删除作为一次写入
+        archive.add(processes)
+        if processes:
+            store.write_batch([{'op': 'delete', 'process': name} for name in processes])
+    print(f"已归档 {len(processes)} 个项目，归档中共 {len(archive)} 个")
+    return 0
+
+
+def cmd_restore(args, store, config):
+    archive = open_archive(archive_dir(args))
+    with store.locked():
+        if store.has_process(args.process):
+            raise SystemExit(f"项目 {args.process} 已存在")
+        process = archive.get(args.process)
+        if process is None:
+            raise SystemExit(f"归档中没有项目 {args.process}")
+        process['info']['mode'] = 'on'
+        store.put_process(args.process, process)
+        archive.remove(args.process)
+    print(f"已恢复 {args.process}")
+    return 0
+
+
+def cmd_template(args, store, config):
+    templates = open_templates(os.path.join(args.data_dir, 'templates.json'))
+    if args.action == 'delete':
+        if args.template is None:
+            raise SystemExit("请用 -t 指定模板")
+        if templates.get(args.template) is None:
+            raise SystemExit(f"模板 {args.template} 不存在")
+        templates.delete(args.template)
+        print(f"已删除模板 {args.template}")
+        return 0
+    for name, template in templates.load().items():
+        when = next_run(template)
+        print(f"{name}\t{template.get('schedule') or '不定时'}\t{len(template.get('roster', []))} 人\t"
+              f"{'下次 ' + when.strftime(TIME_FORMAT) if when else ''}")
+    return 0
+
+
+def cmd_schedule(args, store, config):
+    """为到期的模板各新建一个项目，可由系统的定时任务调用"""
+    templates = open_templates(os.path.join(args.data_dir, 'templates.json'))
+    archive = open_archive(archive_dir(args))
+
+    def add_process(name, process):
+        with store.locked():
+            if store.has_process(name):
+                return False
+            store.put_process(name, process)
+        return True
+
+    for template, name, added in create_due(templates, add_process,
+                                            lambda name: store.has_process(name) or name in archive):
+        print(f"{template}：{'已新建' if added else '已存在'} {name}")
+    return 0
+
+
+def cmd_serve(args, store, config):
+    from sync import SyncServer
+    token = (config.get('sync_token') or '').strip()
+    if not token:
+        print("请先在 config.json 中设置 sync_token，各打卡电脑使用相同的令牌", file=sys.stderr)
+        return 1
+    server = SyncServer(args.data_dir, args.host, args.port, token)
+    print(f"同步服务器监听 {args.host}:{args.port}，数据目录 {args.data_dir}")
+    if args.host not in ('127.0.0.1', 'localhost', '::1'):
+        print("服务器对局域网开放，请确认网络可信", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='punch_manager', description='Punch Manager 命令行')
+    parser.add_argument('--data-dir', default='./data', help='数据目录（默认 ./data）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p_list = subparsers.add_parser('list', help='列出项目')
+    p_list.add_argument('-a', '--all', action='store_true', help='包括已关闭的项目')
+    p_list.set_defaults(func=cmd_list)
+
+    p_status = subparsers.add_parser('status', help='查看项目打卡状态')
+    p_status.add_argument('-p', '--process', help='项目名（默认最近更新的进行中项目）')
+    p_status.add_argument('-n', '--names', action='store_true', help='列出名字')
+    p_status.set_defaults(func=cmd_status)
+
+    p_punch = subparsers.add_parser('punch', help='批量标记已完成/未完成')
+    p_punch.add_argument('status', choices=['finished', 'unfinished'], help='标记为已完成或未完成')
+    p_punch.add_argument('source', nargs='?', default='-', help='名单文件，每行一个名字；- 表示标准输入')
+    p_punch.add_argument('-p', '--process', help='项目名（默认最近更新的进行中项目）')
+    p_punch.add_argument('--dry-run', action='store_true', help='只显示将要进行的更改')
+    p_punch.add_argument('--no-notify', action='store_true', help='不发送钉钉消息')
+    p_punch.add_argument('--timeout', type=float, default=30.0, help='等待钉钉消息送达的秒数')
+    p_punch.set_defaults(func=cmd_punch)
+
+    p_history = subparsers.add_parser('history', help='查看打卡历史')
+    p_history.add_argument('-p', '--process', help='项目名')
+    p_history.add_argument('-m', '--member', help='人员名')
+    p_history.add_argument('--since', type=parse_time, help='起始时间，如 2024-09-01')
+    p_history.add_argument('--until', type=parse_time, help='结束时间（不含）')
+    p_history.set_defaults(func=cmd_history)
+
+    p_report = subparsers.add_parser('report', help='导出完成情况统计 CSV（需要 numpy）')
+    p_report.add_argument('-o', '--out', default='./report', help='输出目录（默认 ./report）')
+    p_report.set_defaults(func=cmd_report)
+
+    p_archive = subparsers.add_parser('archive', help='把已关闭的项目移入压缩归档')
+    p_archive.add_argument('-p', '--process', action='append', help='项目名，可重复（默认全部已关闭的项目）')
+    p_archive.add_argument('--force', action='store_true', help='进行中的项目也归档')
+    p_archive.set_defaults(func=cmd_archive)
+
+    p_restore = subparsers.add_parser('restore', help='从归档中恢复项目并设为进行中')
+    p_restore.add_argument('-p', '--process', required=True, help='项目名')
+    p_restore.set_defaults(func=cmd_restore)
+
+    p_template = subparsers.add_parser('template', help='查看或删除项目模板（在新建项目窗口中保存模板）')
+    p_template.add_argument('action', choices=['list', 'delete'], nargs='?', default='list')
+    p_template.add_argument('-t', '--template', help='模板名（delete 时必填）')
+    p_template.set_defaults(func=cmd_template)
+
+    p_schedule = subparsers.add_parser('schedule', help='为到期的定时模板新建项目')
+    p_schedule.set_defaults(func=cmd_schedule)
+
+    p_serve = subparsers.add_parser('serve', help='运行局域网同步服务器')
+    p_serve.add_argument('--host', default='127.0.0.1',
+                         help='监听地址（默认 127.0.0.1 只允许本机连接，0.0.0.0 对局域网开放）')
+    p_serve.add_argument('--port', type=int, default=8765, help='监听端口（默认 8765）')
+    p_serve.set_defaults(func=cmd_serve)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    data_file = os.path.join(args.data_dir, 'process.json')
+    config_file = os.path.join(args.data_dir, 'config.json')
+    store = open_store(data_file, config_file)
+    return args.func(args, store, read_config(config_file))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
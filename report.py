@@ -0,0 +1,50 @@
+from PyQt6.QtWidgets import QDialog, QFileDialog, QMessageBox, QAbstractItemView
+from ui_loader import load_ui
+from tables import fill_table
+from analytics import StatusMatrix, export_csv, format_rate, MEMBER_HEADER, PROCESS_HEADER, MONTH_HEADER
+
+
+def rate_format(header):
+    """完成率列显示为四位小数、按数值排序"""
+    return {header.index('完成率'): format_rate}
+
+
+class ReportDialog(QDialog):
+    """完成情况统计，数据来自与主窗口共用的仓库"""
+
+    def __init__(self, repository, parent=None):
+        super().__init__(parent)
+        load_ui('report', self)
+
+        self.repository = repository
+        self.matrix = None
+
+        for table in (self.memberTable, self.processTable, self.monthTable):
+            table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+            table.setSortingEnabled(True)
+        self.pushButton.clicked.connect(self.export)
+
+        self.reload()
+
+    def reload(self):
+        """重新计算统计结果"""
+        # 包括归档的项目
+        self.matrix = StatusMatrix(self.repository.all_processes())
+        self.label.setText(f"{len(self.matrix.member_names)} 人，{len(self.matrix.process_names)} 个项目")
+        fill_table(self.memberTable, MEMBER_HEADER, self.matrix.member_rows(), rate_format(MEMBER_HEADER))
+        fill_table(self.processTable, PROCESS_HEADER, self.matrix.process_rows(), rate_format(PROCESS_HEADER))
+        fill_table(self.monthTable, MONTH_HEADER, self.matrix.month_rows(), rate_format(MONTH_HEADER))
+        self.neverList.clear()
+        self.neverList.addItems(self.matrix.never_completed())
+
+    def export(self):
+        """导出 CSV 到选择的目录"""
+        directory = QFileDialog.getExistingDirectory(self, "选择导出目录")
+        if not directory:
+            return
+        try:
+            paths = export_csv(self.matrix, directory)
+        except OSError as e:
+            QMessageBox.warning(self, "导出失败", str(e))
+            return
+        QMessageBox.information(self, "导出完成", "\n".join(paths))
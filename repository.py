@@ -0,0 +1,472 @@
+import threading
+from collections import deque
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from storage import apply_record, prepare_record, write_record, ActiveIndex, MemberTable
+from tracing import traced
+
+
+class BackgroundWriter:
+    """在后台线程中按提交顺序写入修改记录
+
+    每条记录带有写入前预期的存储版本号，存储版本与预期不符（其他站点写入过）时，
+    读取最新数据重新整理记录后再写入。结果放入队列，每完成一条调用一次 on_done（在写入线程中），
+    由调用方在自己的线程中用 take_results 取走。
+    """
+
+    def __init__(self, store, history=None, on_done=None):
+        self.store = store
+        self.history = history
+        self.on_done = on_done
+        self._cond = threading.Condition()
+        # 待写入的 (记录, 预期版本号)，写完后才出队
+        self._jobs = deque()
+        self._results = deque()
+        self._thread = None
+
+    def submit(self, record, expected_version):
+        with self._cond:
+            self._jobs.append((record, expected_version))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='BackgroundWriter', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._jobs:
+                    self._thread = None
+                    self._cond.notify_all()
+                    return
+                record, expected = self._jobs[0]
+            result = self._write(record, expected)
+            with self._cond:
+                self._jobs.popleft()
+                self._results.append(result)
+                self._cond.notify_all()
+            if self.on_done is not None:
+                self.on_done()
+
+    def _write(self, record, expected):
+        """返回 (原记录, 实际写入的记录, 写入后的版本号, 是否与其他站点的修改合并, 失败原因)"""
+        try:
+            with self.store.locked():
+                version = self.store.version()
+                merged = version != expected
+                written = prepare_record(self.store.load(), record) if merged else record
+                if written is not None:
+                    version = write_record(self.store, written)
+                    merged = merged or version != expected + 1
+        except Exception as e:
+            print(f"Failed to save {record['process']}: {str(e)}")
+            return record, None, None, False, str(e)
+        if written is None:
+            return record, None, version, True, f"项目 {record['process']} 已被其他站点删除"
+        if written['op'] == 'punch' and self.history is not None:
+            try:
+                self.history.record(written['process'], written['finished'], written['unfinished'], written.get('ts'))
+            except Exception as e:
+                print(f"Failed to record punch history: {str(e)}")
+        return record, written, version, merged, None
+
+    def pending(self):
+        with self._cond:
+            return len(self._jobs)
+
+    def take_results(self):
+        with self._cond:
+            results = list(self._results)
+            self._results.clear()
+        return results
+
+    def flush(self):
+        """等待所有已提交的记录写入完成"""
+        with self._cond:
+            while self._thread is not None:
+                self._cond.wait()
+
+
+class ProcessRepository(QObject):
+    """应用内共享的项目数据
+
+    启动时从存储读取一次，主窗口和各对话框都读取、修改同一份数据，
+    修改同时写入存储并发出细粒度信号，界面只更新受影响的部分。
+    人员名字在全局人员表中只保存一份，已保存的打卡状态以位图表示。
+    """
+
+    # 新建了项目
+    processAdded = pyqtSignal(str)
+    # 删除了项目
+    processRemoved = pyqtSignal(str)
+    # 项目 mode 改变：项目名, 新 mode
+    modeChanged = pyqtSignal(str, str)
+    # 人员移动：项目名, 新增已完成, 新增未完成
+    membersMoved = pyqtSignal(str, list, list)
+    # 整体重新加载
+    reloaded = pyqtSignal()
+    # 同步服务器推送的修改：版本号, 修改记录（None 表示需要整体重新加载），可从其他线程发出
+    remoteChanged = pyqtSignal(object, object)
+    # 后台保存完成：项目名, 实际写入的新增已完成, 新增未完成
+    saved = pyqtSignal(str, list, list)
+    # 后台保存失败：项目名, 未能保存的新增已完成, 新增未完成, 原因；之后整体重新加载，撤销内存中的修改
+    saveFailed = pyqtSignal(str, list, list, str)
+    # 后台写入线程有结果待处理
+    writeFinished = pyqtSignal()
+
+    def __init__(self, store, parent=None, history=None, archive=None):
+        super().__init__(parent)
+        self.store = store
+        # 打卡事件历史（EventLog），为 None 时不记录
+        self.history = history
+        # 已关闭项目的冷归档（ProcessArchive），为 None 时关闭的项目留在热数据中
+        self.archive = archive
+        # 全局人员表，编号在重新加载后保持不变
+        self.members = MemberTable()
+        # 重新加载时原地更新，持有引用的窗口不会拿到旧数据
+        self.processes = {}
+        with self.store.locked():
+            self._load()
+        self.remoteChanged.connect(self.apply_remote)
+
+        # 已应用到内存、尚未写入存储的打卡记录，按提交顺序
+        self._pending = deque()
+        # 后台写入与其他站点合并或失败过，全部写完后需要重新加载
+        self._stale = False
+        self._writer = BackgroundWriter(store, history, self.writeFinished.emit)
+        self.writeFinished.connect(self._collect)
+
+    @traced('repository.load')
+    def _load(self):
+        """从存储读取全部数据，需在存储锁内调用"""
+        self.version = self.store.version()
+        self.processes.clear()
+        self.processes.update(self.store.load())
+        for process in self.processes.values():
+            self._intern(process)
+        # 进行中项目按更新时间排序的索引
+        self.active = ActiveIndex(self.processes)
+        # 项目名 -> 已保存状态的位图，按需建立
+        self._status = {}
+
+    def _intern(self, process):
+        """各项目名单共享人员表中的字符串"""
+        process['finished'] = self.members.intern_list(process['finished'])
+        process['unfinished'] = self.members.intern_list(process['unfinished'])
+
+    def reload(self):
+        """从存储重新加载全部数据"""
+        self.flush()
+        with self.store.locked():
+            self._load()
+        self.reloaded.emit()
+
+    def _sync(self):
+        """其他站点或实例写入过时重新加载，返回是否重新加载；需在存储锁内调用"""
+        if self.store.version() == self.version:
+            return False
+        self._load()
+        return True
+
+    # ---------- 读取 ----------
+
+    def get(self, name):
+        return self.processes[name]
+
+    def has(self, name):
+        return name in self.processes
+
+    def names(self):
+        return list(self.processes)
+
+    def latest_process(self):
+        """mode 为 on 且最近更新的项目名，O(1)"""
+        return self.active.latest()
+
+    def active_names(self):
+        """mode 为 on 的项目名"""
+        return self.active.names()
+
+    def status(self, name):
+        """项目已保存状态 {'finished': Bitset, 'unfinished': Bitset}，以成员编号为下标"""
+        status = self._status.get(name)
+        if status is None:
+            process = self.processes[name]
+            status = {
+                'finished': self.members.bitset(process['finished']),
+                'unfinished': self.members.bitset(process['unfinished'])
+            }
+            self._status[name] = status
+        return status
+
+    # ---------- 修改 ----------
+    #
+    # 每次修改都在存储锁内先比较版本号，其他站点写入过时先重新加载，
+    # 再把本次的修改应用到最新数据上；这种情况下发出 reloaded 而不是细粒度信号。
+
+    def _commit(self, record):
+        """写入一条修改记录并应用到内存，返回实际写入的记录，无需写入时返回 None"""
+        self.flush()
+        with self.store.locked():
+            merged = self._sync()
+            record = prepare_record(self.processes, record)
+            if record is not None:
+                version = write_record(self.store, record)
+                if version == self.version + 1:
+                    self._apply(record)
+                    self.version = version
+                else:
+                    # 写入前后之间还有其他站点的修改（同步服务器模式）
+                    self._load()
+                    merged = True
+        if merged:
+            self.reloaded.emit()
+        elif record is not None:
+            self._emit(record)
+        return record
+
+    def _apply(self, record):
+        """把一条修改应用到内存数据和各索引"""
+        op = record['op']
+        if op == 'batch':
+            for item in record['records']:
+                self._apply(item)
+            return
+        name = record['process']
+        if op == 'put':
+            self._intern(record['data'])
+        apply_record(self.processes, record)
+        process = self.processes.get(name)
+        if op in ('put', 'delete'):
+            self._status.pop(name, None)
+        if op in ('put', 'delete', 'mode'):
+            self.active.remove(name)
+            if process is not None and process['info']['mode'] == 'on':
+                self.active.add(name, process)
+        elif op == 'punch':
+            self.active.touch(name, process)
+            # 只更新移动人员对应的位
+            status = self._status.get(name)
+            if status is not None:
+                for member in record['finished']:
+                    member_id = self.members.id_of(member)
+                    status['finished'].add(member_id)
+                    status['unfinished'].discard(member_id)
+                for member in record['unfinished']:
+                    member_id = self.members.id_of(member)
+                    status['unfinished'].add(member_id)
+                    status['finished'].discard(member_id)
+
+    def _emit(self, record):
+        op = record['op']
+        if op == 'batch':
+            for item in record['records']:
+                self._emit(item)
+            return
+        name = record['process']
+        if op == 'put' and record.get('restored'):
+            # 从归档放回的项目与重新开启的项目一样处理，不当作新建的项目切换过去
+            self.modeChanged.emit(name, record['data']['info']['mode'])
+        elif op == 'put':
+            self.processAdded.emit(name)
+        elif op == 'delete':
+            self.processRemoved.emit(name)
+        elif op == 'mode':
+            self.modeChanged.emit(name, record['mode'])
+        elif op == 'punch':
+            self.membersMoved.emit(name, record['finished'], record['unfinished'])
+
+    def apply_remote(self, version, record):
+        """应用同步服务器推送的其他站点的修改，版本号不连续时整体重新加载"""
+        if version <= self.version:
+            return
+        if self._pending:
+            # 本机还有打卡在后台写入，全部写完后再整体重新加载
+            self._stale = True
+            return
+        with self.store.locked():
+            incremental = record is not None and version == self.version + 1
+            if incremental:
+                self._apply(record)
+                self.version = version
+            else:
+                self._load()
+        if incremental:
+            self._emit(record)
+        else:
+            self.reloaded.emit()
+
+    def add_process(self, name, process):
+        """新建项目，其他站点已建立同名项目时返回 False"""
+        return self._commit({'op': 'put', 'process': name, 'data': process}) is not None
+
+    def delete_process(self, name):
+        """删除项目"""
+        self._commit({'op': 'delete', 'process': name})
+
+    def set_mode(self, name, mode):
+        """切换项目 mode"""
+        self._commit({'op': 'mode', 'process': name, 'mode': mode})
+
+    def _commit_batch(self, records):
+        """把多条修改作为一次写入提交，返回实际写入的子记录"""
+        if not records:
+            return []
+        record = self._commit({'op': 'batch', 'records': records})
+        return record['records'] if record is not None else []
+
+    def set_modes(self, names, mode):
+        """批量切换 mode，一次写入，返回实际改变的项目名"""
+        written = self._commit_batch([{'op': 'mode', 'process': name, 'mode': mode} for name in names])
+        return [record['process'] for record in written]
+
+    def delete_processes(self, names):
+        """批量删除，一次写入，返回实际删除的项目名"""
+        written = self._commit_batch([{'op': 'delete', 'process': name} for name in names])
+        return [record['process'] for record in written]
+
+    def punch_async(self, name, new_finished, new_unfinished, update_time, update_ts=None):
+        """保存一次打卡结果，立即应用到内存并发出 membersMoved，写入存储在后台线程中进行
+
+        返回按内存数据整理后移动的 (new_finished, new_unfinished)，项目不存在时返回 None。
+        写入完成后发出 saved（其中为与其他站点合并后实际写入的人员），失败时发出 saveFailed。
+        """
+        record = prepare_record(self.processes, {
+            'op': 'punch',
+            'process': name,
+            'finished': list(new_finished),
+            'unfinished': list(new_unfinished),
+            'time': update_time,
+            'ts': update_ts
+        })
+        if record is None:
+            return None
+        # 前面每条未写完的记录都会让版本号加一
+        expected = self.version + len(self._pending)
+        self._pending.append(record)
+        self._writer.submit(record, expected)
+        self._apply(record)
+        self._emit(record)
+        return record['finished'], record['unfinished']
+
+    def pending_saves(self):
+        """尚未写入存储的打卡数"""
+        return len(self._pending)
+
+    def _collect(self):
+        """处理后台写入的结果，在主线程中调用"""
+        for record, written, version, merged, error in self._writer.take_results():
+            self._pending.popleft()
+            if error is not None:
+                self._stale = True
+                self.saveFailed.emit(record['process'], record['finished'], record['unfinished'], error)
+                continue
+            if merged:
+                self._stale = True
+            else:
+                self.version = version
+            self.saved.emit(record['process'], written['finished'], written['unfinished'])
+        if self._stale and not self._pending:
+            self._stale = False
+            with self.store.locked():
+                self._load()
+            self.reloaded.emit()
+
+    def flush(self):
+        """等待后台写入全部完成并处理结果"""
+        self._writer.flush()
+        self._collect()
+
+    # ---------- 归档 ----------
+
+    def archived(self):
+        """归档项目的元数据 {项目名: {...}}，不解压分段；热数据中也有的同名项目不计"""
+        if self.archive is None:
+            return {}
+        return {name: meta for name, meta in self.archive.index().items() if name not in self.processes}
+
+    def archive_processes(self, names):
+        """关闭项目并移入归档，从热数据中一次删除，返回归档的项目名"""
+        if self.archive is None:
+            return []
+        self.flush()
+        with self.store.locked():
+            merged = self._sync()
+            processes = {}
+            for name in names:
+                if name in self.processes:
+                    process = self.processes[name]
+                    processes[name] = dict(process, info=dict(process['info'], mode='off'))
+            # 先写入归档再删除，中途崩溃时项目同时留在两处，不会丢失
+            self.archive.add(processes)
+            self._commit_batch([{'op': 'delete', 'process': name} for name in processes])
+        if merged:
+            self.reloaded.emit()
+        return list(processes)
+
+    def enable_processes(self, names):
+        """开启项目，归档的项目解压后放回，一次写入，返回开启的项目名"""
+        self.flush()
+        with self.store.locked():
+            # 先取得其他站点的修改，已有同名项目的不从归档放回
+            merged = self._sync()
+            records = []
+            for name in names:
+                if name in self.processes:
+                    records.append({'op': 'mode', 'process': name, 'mode': 'on'})
+                    continue
+                process = self.archive.get(name) if self.archive is not None else None
+                if process is None:
+                    continue
+                process['info']['mode'] = 'on'
+                records.append({'op': 'put', 'process': name, 'data': process, 'restored': True})
+            written = self._commit_batch(records)
+            # 只删除确实放回的归档，合并时被丢弃的仍留在归档中
+            restored = [record['process'] for record in written if record['op'] == 'put']
+            if restored:
+                self.archive.remove_all(restored)
+        if merged:
+            self.reloaded.emit()
+        return [record['process'] for record in written]
+
+    def restore_process(self, name):
+        """把归档的项目放回热数据并设为进行中，返回是否成功"""
+        if self.archive is None or name not in self.archive:
+            return False
+        return bool(self.enable_processes([name]))
+
+    def delete_archived(self, names):
+        """删除归档中的项目"""
+        if self.archive is not None:
+            self.archive.remove_all(names)
+
+    def all_processes(self):
+        """热数据和归档中的全部项目，用于统计；会解压全部分段"""
+        if self.archive is None:
+            return self.processes
+        data = self.archive.load_all()
+        data.update(self.processes)
+        return data
+
+    def punch(self, name, new_finished, new_unfinished, update_time, update_ts=None):
+        """保存一次打卡结果，只记录移动的人员
+
+        本次的移动合并到存储中的最新状态上：其他站点已经做过相同移动的人员不再重复记录。
+        返回实际移动的 (new_finished, new_unfinished)，项目已被其他站点删除时返回 None。
+        """
+        record = self._commit({
+            'op': 'punch',
+            'process': name,
+            'finished': list(new_finished),
+            'unfinished': list(new_unfinished),
+            'time': update_time,
+            'ts': update_ts
+        })
+        if record is None:
+            return None
+        if self.history is not None:
+            try:
+                self.history.record(name, record['finished'], record['unfinished'], update_ts)
+            except Exception as e:
+                print(f"Failed to record punch history: {str(e)}")
+        return record['finished'], record['unfinished']
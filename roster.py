@@ -0,0 +1,245 @@
+from PyQt6.QtWidgets import QListView, QStyledItemDelegate, QAbstractItemView
+from PyQt6.QtCore import Qt, QAbstractListModel, QSortFilterProxyModel, QModelIndex, QRectF, QSize, pyqtSignal
+from PyQt6.QtGui import QColor, QFont, QPen
+
+
+# 自定义数据角色：人员显示状态
+STATE_ROLE = Qt.ItemDataRole.UserRole + 1
+
+STATE_NORMAL = 0
+STATE_NEW_FINISHED = 1
+STATE_NEW_UNFINISHED = 2
+
+
+class IndexedList:
+    """保持插入顺序的名单，按名字定位、删除和按行取值都是 O(log n)
+
+    删除只在槽位上留下空位，用树状数组统计每个槽位之前的有效人数来换算行号，
+    空位过多时再整体压缩。名字在名单中唯一。
+    """
+
+    def __init__(self, names=()):
+        self._rebuild(dict.fromkeys(names))
+
+    def _rebuild(self, names):
+        self._slots = list(names)
+        self._pos = {name: i for i, name in enumerate(self._slots)}
+        # 树状数组（下标从 1 开始），初始每个槽位都有效
+        n = len(self._slots)
+        self._tree = [0] * (n + 1)
+        for i in range(1, n + 1):
+            self._tree[i] += 1
+            j = i + (i & -i)
+            if j <= n:
+                self._tree[j] += self._tree[i]
+
+    def __len__(self):
+        return len(self._pos)
+
+    def __contains__(self, name):
+        return name in self._pos
+
+    def __iter__(self):
+        return (name for name in self._slots if name is not None)
+
+    def index(self, name):
+        """名字所在的行号"""
+        i = self._pos[name] + 1
+        row = 0
+        while i > 0:
+            row += self._tree[i]
+            i -= i & -i
+        return row - 1
+
+    def __getitem__(self, row):
+        """第 row 行的名字"""
+        if not 0 <= row < len(self._pos):
+            raise IndexError(row)
+        # 在树状数组上二分查找前缀和为 row + 1 的槽位
+        remaining = row + 1
+        i = 0
+        step = 1 << (len(self._slots).bit_length())
+        while step:
+            j = i + step
+            if j < len(self._tree) and self._tree[j] < remaining:
+                i = j
+                remaining -= self._tree[j]
+            step >>= 1
+        return self._slots[i]
+
+    def append(self, name):
+        """追加到末尾，返回行号"""
+        self._slots.append(name)
+        i = len(self._slots)
+        self._pos[name] = i - 1
+        # 新节点覆盖 (i - lowbit(i), i]，由其子节点累加得到
+        total = 1
+        j = i - 1
+        while j > i - (i & -i):
+            total += self._tree[j]
+            j -= j & -j
+        self._tree.append(total)
+        return len(self._pos) - 1
+
+    def remove(self, name):
+        """删除并返回原来的行号"""
+        row = self.index(name)
+        slot = self._pos.pop(name)
+        self._slots[slot] = None
+        i = slot + 1
+        while i < len(self._tree):
+            self._tree[i] -= 1
+            i += i & -i
+        # 空位超过一半时压缩
+        if len(self._slots) > 64 and len(self._pos) * 2 < len(self._slots):
+            self._rebuild(self)
+        return row
+
+
+class RosterModel(QAbstractListModel):
+    """一列人员名单（未打卡或已打卡）
+
+    is_new 用来判断某人是否是本次运行新移动过来的，结果作为 STATE_ROLE 交给委托绘制。
+    """
+
+    def __init__(self, is_finished, is_new=None, parent=None):
+        super().__init__(parent)
+        self.is_finished = is_finished
+        self.is_new = is_new or (lambda name: False)
+        self.names = IndexedList()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.names)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        name = self.names[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return name
+        if role == STATE_ROLE:
+            if not self.is_new(name):
+                return STATE_NORMAL
+            return STATE_NEW_FINISHED if self.is_finished else STATE_NEW_UNFINISHED
+        return None
+
+    def set_names(self, names):
+        """整体替换名单"""
+        self.beginResetModel()
+        self.names = IndexedList(names)
+        self.endResetModel()
+
+    def append(self, name):
+        """在末尾追加一人"""
+        row = len(self.names)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.names.append(name)
+        self.endInsertRows()
+
+    def remove(self, name):
+        """移除一人，只通知视图这一行"""
+        row = self.names.index(name)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        self.names.remove(name)
+        self.endRemoveRows()
+
+    def refresh_states(self):
+        """current_changes 变化后通知视图重绘状态"""
+        if self.names:
+            self.dataChanged.emit(self.index(0), self.index(len(self.names) - 1), [STATE_ROLE])
+
+
+class RosterFilter(QSortFilterProxyModel):
+    """只显示检索命中的人员，不改动底层名单"""
+
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setSourceModel(model)
+        # 过滤只看名字，高亮状态变化（dataChanged）时不必重新过滤整列
+        self.setDynamicSortFilter(False)
+        # None 表示不过滤
+        self.visible = None
+
+    def set_visible(self, names):
+        """设置要显示的名字集合，None 显示全部"""
+        self.visible = names
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.visible is None:
+            return True
+        return self.sourceModel().names[source_row] in self.visible
+
+
+class RosterDelegate(QStyledItemDelegate):
+    """按 STATE_ROLE 绘制人员格子，替代每个 QLabel 的样式表"""
+
+    # 状态 -> (背景色, 边框色)
+    COLORS = {
+        STATE_NORMAL: (None, QColor(128, 128, 128)),
+        STATE_NEW_FINISHED: (QColor(0, 255, 0, 51), QColor(0, 255, 0)),
+        STATE_NEW_UNFINISHED: (QColor(255, 255, 0, 51), QColor(255, 255, 0)),
+    }
+    MARGIN = 2
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.font = QFont()
+        self.font.setPointSize(14)
+
+    def paint(self, painter, option, index):
+        background, border = self.COLORS.get(index.data(STATE_ROLE), self.COLORS[STATE_NORMAL])
+        rect = QRectF(option.rect).adjusted(self.MARGIN + 0.5, self.MARGIN + 0.5,
+                                            -self.MARGIN - 0.5, -self.MARGIN - 0.5)
+        painter.save()
+        if background is not None:
+            painter.fillRect(rect, background)
+        painter.setPen(QPen(border, 1))
+        painter.drawRect(rect)
+        painter.setFont(self.font)
+        painter.setPen(option.palette.color(option.palette.ColorRole.Text))
+        painter.drawText(rect, Qt.AlignmentFlag.AlignCenter, index.data())
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        # 铺满视图的网格单元
+        view = self.parent()
+        if isinstance(view, QListView) and view.gridSize().isValid():
+            return view.gridSize()
+        return QSize(100, 30 + 2 * self.MARGIN)
+
+
+class RosterView(QListView):
+    """网格模式的名单视图，只绘制可见的格子"""
+
+    # 点击某人时发出其名字
+    nameClicked = pyqtSignal(str)
+
+    COLUMNS = 5
+    ROW_HEIGHT = 34
+
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setModel(model)
+        self.setItemDelegate(RosterDelegate(self))
+        self.setViewMode(QListView.ViewMode.IconMode)
+        self.setFlow(QListView.Flow.LeftToRight)
+        self.setWrapping(True)
+        self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.setMovement(QListView.Movement.Static)
+        self.setUniformItemSizes(True)
+        self.setSpacing(0)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.clicked.connect(lambda index: self.nameClicked.emit(index.data()))
+
+    def resizeEvent(self, event):
+        # 保持每行固定列数，格子宽度随窗口变化
+        width = max(100, (self.viewport().width() - 1) // self.COLUMNS)
+        self.setGridSize(QSize(width, self.ROW_HEIGHT))
+        super().resizeEvent(event)
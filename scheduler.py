@@ -0,0 +1,89 @@
+"""按模板定时创建项目
+
+所有模板共用一个 QTimer：下一次触发时间排成一个堆，定时器只等待堆顶的那一个，
+到时处理全部到期的模板后重新排入。模板修改后调用 reload 重新排队。
+"""
+import heapq
+import time
+
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
+from templates import next_run, run_template
+
+
+# 单次等待的上限（毫秒），系统休眠或调整时钟后最迟这么久重新检查
+MAX_WAIT = 60 * 60 * 1000
+# 创建失败（如同步服务器断开）后重试的间隔（秒）
+RETRY_DELAY = 60
+
+
+class TemplateScheduler(QObject):
+    # 信号：按模板新建了项目（模板名, 项目名）
+    processCreated = pyqtSignal(str, str)
+
+    def __init__(self, repository, templates, parent=None):
+        super().__init__(parent)
+        self.repository = repository
+        self.templates = templates
+        # (触发时间戳, 模板名) 的最小堆
+        self._queue = []
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._fire)
+
+    def reload(self):
+        """重新读取全部模板并排队，已错过的立即触发"""
+        queue = []
+        for name, template in self.templates.load().items():
+            when = self._next(name, template)
+            if when is not None:
+                queue.append((when, name))
+        heapq.heapify(queue)
+        self._queue = queue
+        self._arm()
+
+    def stop(self):
+        self.timer.stop()
+        self._queue = []
+
+    def pending(self):
+        """[(触发时间戳, 模板名)]，按时间排序"""
+        return sorted(self._queue)
+
+    @staticmethod
+    def _next(name, template):
+        try:
+            when = next_run(template)
+        except ValueError as e:
+            print(f"Failed to schedule template {name}: {str(e)}")
+            return None
+        return when.timestamp() if when is not None else None
+
+    def _arm(self):
+        self.timer.stop()
+        if self._queue:
+            delay = (self._queue[0][0] - time.time()) * 1000
+            self.timer.start(int(min(max(delay, 0), MAX_WAIT)))
+
+    def _exists(self, name):
+        return self.repository.has(name) or name in self.repository.archived()
+
+    def _fire(self):
+        now = time.time()
+        while self._queue and self._queue[0][0] <= now:
+            _, name = heapq.heappop(self._queue)
+            # 重新读取，其他站点可能已修改模板或已代为创建
+            template = self.templates.get(name)
+            if template is None or not template.get('schedule'):
+                continue
+            try:
+                result = run_template(self.templates, name, template, self.repository.add_process, self._exists)
+            except (ValueError, ConnectionError) as e:
+                print(f"Failed to create process from template {name}: {str(e)}")
+                heapq.heappush(self._queue, (now + RETRY_DELAY, name))
+                continue
+            if result is not None and result[1]:
+                self.processCreated.emit(name, result[0])
+            when = self._next(name, self.templates.get(name) or template)
+            if when is not None:
+                heapq.heappush(self._queue, (max(when, now + 1), name))
+        self._arm()
@@ -0,0 +1,98 @@
+import bisect
+import itertools
+
+
+# 多音字组合过多时只取前几种读音组合
+MAX_READINGS = 8
+
+_pinyin = None
+
+
+def _readings(name):
+    """每个字的拼音读音列表，未安装 pypinyin 时返回 None"""
+    global _pinyin
+    if _pinyin is None:
+        try:
+            from pypinyin import pinyin, Style
+            _pinyin = lambda text: pinyin(text, style=Style.NORMAL, heteronym=True)
+        except ImportError:
+            print("pypinyin is not installed, search by pinyin is disabled")
+            _pinyin = False
+    if not _pinyin:
+        return None
+    return [[reading.lower() for reading in readings] for readings in _pinyin(name)]
+
+
+def search_keys(name):
+    """名字的所有检索键 [(键, 是否从第一个字开始)]
+
+    包括原名、拼音全拼和首字母，每种都从每个字的位置开始各取一份，
+    这样输入名字的后半部分（如只输入名）也能按前缀匹配。
+    """
+    keys = {}
+    lowered = name.lower()
+    for i in range(len(lowered)):
+        keys[lowered[i:]] = keys.get(lowered[i:], False) or i == 0
+    readings = _readings(name)
+    if readings:
+        for syllables in itertools.islice(itertools.product(*readings), MAX_READINGS):
+            for i in range(len(syllables)):
+                for key in (''.join(syllables[i:]), ''.join(s[0] for s in syllables[i:] if s)):
+                    keys[key] = keys.get(key, False) or i == 0
+    keys.pop('', None)
+    return list(keys.items())
+
+
+class PrefixIndex:
+    """按前缀检索名字的索引
+
+    所有 (检索键, 名字) 按键排序存放，一次查询是两次二分查找加上结果区间的遍历，
+    与名单总人数无关。新名字先记下，第一次检索时才计算拼音并排序。
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._names = set()
+        self._pending = set()
+        # 完整检索键（原名、全拼、首字母） -> 名字集合
+        self._whole = {}
+
+    def __contains__(self, name):
+        return name in self._names or name in self._pending
+
+    def update(self, names):
+        """加入尚未索引的名字"""
+        self._pending.update(name for name in names if name not in self._names)
+
+    def _build(self):
+        if not self._pending:
+            return
+        added = []
+        for name in self._pending:
+            for key, whole in search_keys(name):
+                added.append((key, name))
+                if whole:
+                    self._whole.setdefault(key, set()).add(name)
+        self._names.update(self._pending)
+        self._pending.clear()
+        if len(added) * 8 < len(self._entries):
+            for entry in added:
+                bisect.insort(self._entries, entry)
+        else:
+            self._entries.extend(added)
+            self._entries.sort()
+
+    def search(self, prefix):
+        """以 prefix 开头（不区分大小写）的名字集合"""
+        self._build()
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return set(self._names)
+        start = bisect.bisect_left(self._entries, (prefix,))
+        end = bisect.bisect_left(self._entries, (prefix + '\U0010ffff',))
+        return {name for _, name in self._entries[start:end]}
+
+    def exact(self, text):
+        """原名、全拼或首字母与 text 完全相同的名字集合"""
+        self._build()
+        return set(self._whole.get(text.strip().lower(), ()))
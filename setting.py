@@ -1,19 +1,30 @@
 import json
 from PyQt6.QtWidgets import QDialog
-from PyQt6.QtCore import pyqtSignal
-from PyQt6.uic import loadUi
+from PyQt6.QtCore import pyqtSignal, QTimer
+from ui_loader import load_ui
+from storage import ConfigWriter
 
 
 class SettingDialog(QDialog):
     # 定义关闭信号
     closed = pyqtSignal()
 
+    # 输入停止多久后写入（毫秒）
+    SAVE_DELAY = 500
+
     def __init__(self, parent=None):
         super().__init__(parent)
-        loadUi('./ui/setting.ui', self)
+        load_ui('setting', self)
 
         # 配置文件路径
         self.config_file = './data/config.json'
+        self.config_writer = ConfigWriter(self.config_file)
+
+        # 合并连续输入，停顿后再保存
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(self.SAVE_DELAY)
+        self.save_timer.timeout.connect(self.save_config)
 
         # 加载配置
         self.load_config()
@@ -40,6 +51,11 @@ class SettingDialog(QDialog):
         self.plainTextEdit.setPlainText('\n'.join(self.config['name']))
         self.label_4.setText(self.config['dingtalk_bot'] or "关闭")
 
+    def reload(self):
+        """重复打开时重新读取配置，不触发保存"""
+        self.load_config()
+        self.save_timer.stop()
+
     def save_config(self):
         """保存配置到 config.json"""
         # 获取 plainTextEdit 的名字列表，过滤空行
@@ -51,15 +67,25 @@ class SettingDialog(QDialog):
         self.config['name'] = names
         # dingtalk_bot 由 buttonBox 控制，不在此更新
 
-        # 保存到文件
-        with open(self.config_file, 'w', encoding='utf-8') as f:
-            json.dump(self.config, f, ensure_ascii=False, indent=2)
+        # 交给后台线程原子写入
+        self.save_timer.stop()
+        self.config_writer.submit(self.config)
+
+    def schedule_save(self):
+        """输入变化时重新计时，停顿 SAVE_DELAY 后保存"""
+        self.save_timer.start()
+
+    def flush_config(self):
+        """立即保存未写入的更改并等待写入完成"""
+        if self.save_timer.isActive():
+            self.save_config()
+        self.config_writer.flush()
 
     def connect_signals(self):
         """连接控件信号以检测更改和按钮操作"""
-        self.lineEdit.textChanged.connect(self.save_config)
-        self.lineEdit_2.textChanged.connect(self.save_config)
-        self.plainTextEdit.textChanged.connect(self.save_config)
+        self.lineEdit.textChanged.connect(self.schedule_save)
+        self.lineEdit_2.textChanged.connect(self.schedule_save)
+        self.plainTextEdit.textChanged.connect(self.schedule_save)
 
         # buttonBox 按钮操作
         self.buttonBox.accepted.connect(self.on_open_clicked)
@@ -77,7 +103,13 @@ class SettingDialog(QDialog):
         self.label_4.setText("关闭")
         self.save_config()
 
+    def done(self, result):
+        """按 Esc 等方式关闭时同样保存"""
+        self.flush_config()
+        super().done(result)
+
     def closeEvent(self, event):
-        """窗口关闭时发出信号"""
+        """窗口关闭时保存并发出信号"""
+        self.flush_config()
         self.closed.emit()
         super().closeEvent(event)
\ No newline at end of file
@@ -0,0 +1,418 @@
+"""局域网同步服务
+
+一台电脑运行同步服务器，持有唯一的一份项目数据：
+
+    python -m punch_manager serve --host 0.0.0.0 --port 8765
+
+服务器和各打卡电脑的 data/config.json 中设置相同的 "sync_token"，打卡电脑再设置
+"sync_server": "服务器地址:8765"，启动后从服务器取得全部数据，之后只收发单条修改记录
+（与变更日志的记录格式相同），不传输整个文件。令牌不对的连接在 hello 时被断开，
+格式不正确的记录不会写入。
+
+协议为 TCP 上逐行的 UTF-8 JSON 消息：
+    客户端 -> 服务器  {"op": "hello", "version": v, "token": "..."}
+                      {"op": "write", "id": n, "record": {...}}
+    服务器 -> 客户端  {"op": "snapshot", "version": V, "data": {...}}
+                      {"op": "delta", "version": V, "record": {...}}
+                      {"op": "ack", "id": n, "version": V, "record": {...} | null, "error": "..."}
+                      {"op": "error", "message": "..."}
+"""
+import asyncio
+import concurrent.futures
+import hmac
+import json
+import os
+import threading
+from collections import deque
+
+from storage import open_store, apply_record, check_record, prepare_record, write_record
+from history import open_history
+
+
+DEFAULT_PORT = 8765
+# 单行消息上限，首次同步的快照可能较大
+MESSAGE_LIMIT = 64 * 1024 * 1024
+# 服务器保留的最近修改条数，断线重连的客户端在此范围内只补发缺少的修改
+LOG_SIZE = 1000
+RECONNECT_DELAY = 2.0
+
+
+def encode_message(message):
+    return (json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def parse_address(text, default_port=DEFAULT_PORT):
+    """'host:port' 或 'host' -> (host, port)"""
+    host, sep, port = text.strip().rpartition(':')
+    if not sep:
+        return text.strip(), default_port
+    return host, int(port)
+
+
+class SyncServer:
+    """持有权威数据的同步服务器
+
+    修改按到达顺序逐条写入本地存储，整理（合并）后回复发送方并推送给其他客户端。
+    设置了 token 时只接受 hello 中带相同令牌的客户端。
+    可用 with 语句在后台线程中启动，用于本地测试。
+    """
+
+    def __init__(self, data_dir='./data', host='127.0.0.1', port=DEFAULT_PORT, token=None):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.store = open_store(os.path.join(data_dir, 'process.json'), os.path.join(data_dir, 'config.json'))
+        self.history = open_history(os.path.join(data_dir, 'history'))
+        self.data = None
+        self.version = None
+        # 最近的 (版本号, 记录)
+        self.log = deque(maxlen=LOG_SIZE)
+        # 客户端 -> 待发送消息队列（已编码）
+        self.clients = {}
+        self.address = None
+
+        self._loop = None
+        self._write_lock = None
+        # 进行中的连接处理任务和对应的连接，停止时用
+        self._handlers = set()
+        self._connections = set()
+        self._thread = None
+        self._server = None
+        self._started = threading.Event()
+
+    # ---------- 数据 ----------
+
+    def _sync(self):
+        """本机其他程序直接写入过存储时重新加载，返回是否重新加载；需在存储锁内调用"""
+        version = self.store.version()
+        if version == self.version:
+            return False
+        self.data = self.store.load()
+        self.version = version
+        self.log.clear()
+        return True
+
+    def _commit(self, record):
+        """写入一条修改，返回 (是否重新加载, 实际写入的记录)，在线程池中执行"""
+        check_record(record)
+        with self.store.locked():
+            reloaded = self._sync()
+            record = prepare_record(self.data, record)
+            if record is None:
+                return reloaded, None
+            version = write_record(self.store, record)
+            if version != self.version + 1:
+                self.data = self.store.load()
+                self.version = version
+                self.log.clear()
+                return True, record
+            apply_record(self.data, record)
+            self.version = version
+            self.log.append((version, record))
+        if record['op'] == 'punch':
+            try:
+                self.history.record(record['process'], record['finished'], record['unfinished'], record.get('ts'))
+            except Exception as e:
+                print(f"Failed to record punch history: {str(e)}")
+        return False, record
+
+    def _catch_up(self, version):
+        """版本号 version 之后的消息：在 log 范围内时为逐条修改，否则为整个快照"""
+        if version == self.version:
+            return []
+        if self.log and self.log[0][0] <= version + 1 and version < self.version:
+            return [{'op': 'delta', 'version': v, 'record': r} for v, r in self.log if v > version]
+        return [{'op': 'snapshot', 'version': self.version, 'data': self.data}]
+
+    # ---------- 连接 ----------
+
+    def _authorized(self, message):
+        if self.token is None:
+            return True
+        token = message.get('token')
+        return isinstance(token, str) and hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8'))
+
+    async def _handle(self, reader, writer):
+        queue = asyncio.Queue()
+        sender = asyncio.create_task(self._send(queue, writer))
+        self._handlers.add(asyncio.current_task())
+        self._connections.add(writer)
+        authorized = False
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if not isinstance(message, dict):
+                    raise ValueError("message is not an object")
+                if not authorized:
+                    if message.get('op') != 'hello' or not self._authorized(message):
+                        print(f"Sync client rejected: {writer.get_extra_info('peername')}")
+                        writer.write(encode_message({'op': 'error', 'message': "同步令牌不正确"}))
+                        await writer.drain()
+                        break
+                    authorized = True
+                if message.get('op') == 'hello':
+                    async with self._write_lock:
+                        await asyncio.to_thread(self._refresh)
+                        for reply in self._catch_up(message.get('version', -1)):
+                            queue.put_nowait(encode_message(reply))
+                        self.clients[writer] = queue
+                elif message.get('op') == 'write':
+                    async with self._write_lock:
+                        try:
+                            reloaded, record = await asyncio.to_thread(self._commit, message['record'])
+                        except ValueError as e:
+                            # 坏记录只拒绝这一次写入，不断开连接
+                            print(f"Sync client sent an invalid record: {str(e)}")
+                            queue.put_nowait(encode_message({'op': 'ack', 'id': message['id'], 'version': self.version,
+                                                             'record': None, 'error': str(e)}))
+                            continue
+                        if reloaded:
+                            self._broadcast({'op': 'snapshot', 'version': self.version, 'data': self.data})
+                        elif record is not None:
+                            self._broadcast({'op': 'delta', 'version': self.version, 'record': record},
+                                            exclude=writer)
+                        queue.put_nowait(encode_message({'op': 'ack', 'id': message['id'],
+                                                         'version': self.version, 'record': record}))
+        except (OSError, ValueError, KeyError, TypeError, AttributeError, asyncio.LimitOverrunError) as e:
+            print(f"Sync client error: {str(e)}")
+        finally:
+            self.clients.pop(writer, None)
+            self._connections.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            sender.cancel()
+            writer.close()
+
+    def _refresh(self):
+        with self.store.locked():
+            if self._sync():
+                self._broadcast_threadsafe({'op': 'snapshot', 'version': self.version, 'data': self.data})
+
+    def _broadcast_threadsafe(self, message):
+        self._loop.call_soon_threadsafe(self._broadcast, message)
+
+    def _broadcast(self, message, exclude=None):
+        # 入队时即编码，之后 self.data 的修改不会影响已排队的快照
+        data = encode_message(message)
+        for writer, queue in self.clients.items():
+            if writer is not exclude:
+                queue.put_nowait(data)
+
+    @staticmethod
+    async def _send(queue, writer):
+        try:
+            while True:
+                writer.write(await queue.get())
+                await writer.drain()
+        except (OSError, asyncio.CancelledError):
+            pass
+
+    async def serve(self):
+        """在当前事件循环中运行服务器"""
+        self._loop = asyncio.get_running_loop()
+        self._write_lock = asyncio.Lock()
+        with self.store.locked():
+            self._sync()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=MESSAGE_LIMIT)
+        self.address = self._server.sockets[0].getsockname()[:2]
+        self._started.set()
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+    # ---------- 后台线程（本地测试） ----------
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        self._started.wait(10)
+        return self
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result(5)
+        self._thread.join(5)
+
+    async def stop(self):
+        """断开所有客户端，等各连接处理结束后停止服务器"""
+        for writer in list(self._connections):
+            writer.close()
+        if self._handlers:
+            await asyncio.wait(list(self._handlers), timeout=5)
+        self._server.close()
+
+
+class RemoteStore:
+    """连接同步服务器的存储，接口与 JournalStore / SqliteStore 相同
+
+    后台线程维持连接并保存一份服务器数据的镜像，断线后自动重连并补齐缺少的修改。
+    写入等待服务器确认，未连接或超时时抛出 ConnectionError。
+    on_change(版本号, 记录) 在收到其他站点的修改后从后台线程调用，记录为 None 表示需要整体重新加载。
+    服务器拒绝连接（如令牌不对）时原因保存在 error 中。
+    """
+
+    def __init__(self, host, port=DEFAULT_PORT, on_change=None, timeout=10.0, token=None):
+        self.host = host
+        self.port = port
+        self.on_change = on_change
+        self.timeout = timeout
+        self.token = token
+        self.error = None
+
+        self._mirror = {}
+        self._version = -1
+        self._mirror_lock = threading.Lock()
+        # 本机内的写入锁；站点之间的冲突由服务器逐条整理
+        self._write_lock = threading.RLock()
+        self._ready = threading.Event()
+        self._writer = None
+        self._pending = {}
+        self._next_id = 0
+        self._closed = False
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._task = asyncio.run_coroutine_threadsafe(self._run(), self._loop)
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    def wait_ready(self, timeout=None):
+        """等待首次同步完成"""
+        return self._ready.wait(timeout)
+
+    # ---------- 连接 ----------
+
+    async def _run(self):
+        while not self._closed:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port, limit=MESSAGE_LIMIT)
+            except OSError:
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            try:
+                writer.write(encode_message({'op': 'hello', 'version': self._version, 'token': self.token}))
+                await writer.drain()
+                self._writer = writer
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self._handle(json.loads(line))
+            except (OSError, ValueError, asyncio.LimitOverrunError) as e:
+                print(f"Sync connection error: {str(e)}")
+            finally:
+                self._writer = None
+                for future in self._pending.values():
+                    if not future.done():
+                        future.set_exception(ConnectionError("与同步服务器的连接已断开"))
+                self._pending.clear()
+                writer.close()
+            if not self._closed:
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    def _handle(self, message):
+        op = message.get('op')
+        if op == 'snapshot':
+            with self._mirror_lock:
+                self._mirror = message['data']
+                self._version = message['version']
+            self._ready.set()
+            self._notify(message['version'], None)
+        elif op == 'delta':
+            with self._mirror_lock:
+                if message['version'] != self._version + 1:
+                    # 缺少中间的修改，重新连接以取得完整数据
+                    raise ValueError(f"sync version gap {self._version} -> {message['version']}")
+                apply_record(self._mirror, message['record'])
+                self._version = message['version']
+            self._ready.set()
+            self._notify(message['version'], message['record'])
+        elif op == 'error':
+            self.error = message.get('message')
+            print(f"Sync server refused the connection: {self.error}")
+        elif op == 'ack':
+            with self._mirror_lock:
+                if message['record'] is not None:
+                    apply_record(self._mirror, message['record'])
+                self._version = message['version']
+            future = self._pending.pop(message['id'], None)
+            if future is not None and not future.done():
+                future.set_result(message)
+
+    def _notify(self, version, record):
+        if self.on_change is not None:
+            # 交给接收方的记录与镜像互不共享
+            self.on_change(version, json.loads(json.dumps(record)) if record is not None else None)
+
+    async def _request(self, record):
+        if self._writer is None:
+            raise ConnectionError("未连接同步服务器")
+        self._next_id += 1
+        future = self._loop.create_future()
+        self._pending[self._next_id] = future
+        self._writer.write(encode_message({'op': 'write', 'id': self._next_id, 'record': record}))
+        await self._writer.drain()
+        return await future
+
+    def _write(self, record):
+        future = asyncio.run_coroutine_threadsafe(self._request(record), self._loop)
+        try:
+            reply = future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise ConnectionError("同步服务器无响应")
+        if reply.get('error'):
+            # 与断线同样处理：界面提示失败并保留更改
+            raise ConnectionError(f"同步服务器拒绝了修改：{reply['error']}")
+        return reply['version']
+
+    # ---------- 存储接口 ----------
+
+    def locked(self):
+        return self._write_lock
+
+    def version(self):
+        return self._version
+
+    def load(self):
+        with self._mirror_lock:
+            return json.loads(json.dumps(self._mirror))
+
+    def has_process(self, name):
+        with self._mirror_lock:
+            return name in self._mirror
+
+    def process_modes(self):
+        with self._mirror_lock:
+            return {name: process['info']['mode'] for name, process in self._mirror.items()}
+
+    def put_process(self, name, process):
+        return self._write({'op': 'put', 'process': name, 'data': process})
+
+    def delete_process(self, name):
+        return self._write({'op': 'delete', 'process': name})
+
+    def set_mode(self, name, mode):
+        return self._write({'op': 'mode', 'process': name, 'mode': mode})
+
+    def punch(self, name, new_finished, new_unfinished, update_time, update_ts=None):
+        return self._write({'op': 'punch', 'process': name, 'finished': sorted(new_finished),
+                            'unfinished': sorted(new_unfinished), 'time': update_time, 'ts': update_ts})
+
+    def write_batch(self, records):
+        return self._write({'op': 'batch', 'records': records})
+
+    def close(self):
+        self._closed = True
+        if self._writer is not None:
+            self._loop.call_soon_threadsafe(self._writer.close)
+        self._task.cancel()
@@ -0,0 +1,45 @@
+"""统计和追踪窗口共用的表格填充"""
+from PyQt6.QtWidgets import QTableWidgetItem
+from PyQt6.QtCore import Qt
+
+
+# 带显示格式的单元格保存原值的数据角色
+SORT_ROLE = Qt.ItemDataRole.UserRole + 1
+
+
+class FormattedItem(QTableWidgetItem):
+    """显示格式化后的文字、按原值排序的单元格，原值为 None（无数据）的排在最前"""
+
+    def __lt__(self, other):
+        key = self.data(SORT_ROLE)
+        other_key = other.data(SORT_ROLE)
+        if key is None or other_key is None:
+            return key is None and other_key is not None
+        return key < other_key
+
+
+def fill_table(table, header, rows, formats=None):
+    """用 rows 重新填充表格，保持原来的排序开关
+
+    formats 为 {列号: 显示格式函数}，这些列显示格式化后的文字、按原值排序；
+    其余列直接显示原值，数值列按数值排序。
+    """
+    formats = formats or {}
+    rows = list(rows)
+    sorting = table.isSortingEnabled()
+    table.setSortingEnabled(False)
+    table.clear()
+    table.setColumnCount(len(header))
+    table.setHorizontalHeaderLabels(header)
+    table.setRowCount(len(rows))
+    for i, row in enumerate(rows):
+        for j, value in enumerate(row):
+            if j in formats:
+                item = FormattedItem(formats[j](value))
+                item.setData(SORT_ROLE, value)
+            else:
+                item = QTableWidgetItem()
+                item.setData(Qt.ItemDataRole.DisplayRole, value)
+            table.setItem(i, j, item)
+    table.setSortingEnabled(sorting)
+    table.resizeColumnsToContents()
@@ -0,0 +1,265 @@
+"""项目模板与定时创建
+
+data/templates.json 结构与 process.json 类似，以模板名为键：
+
+    {"每日健康打卡": {"description": "", "at_name": [], "targets": [], "roster": [...],
+                     "schedule": "0 8 * * 1-5", "title": "%m-%d", "last_run": 1729212000.0}}
+
+schedule 为五段 cron 表达式（分 时 日 月 周），留空表示只作为新建项目时的模板；
+到期时创建名为 “模板名 + 触发时间按 title 格式化” 的项目，last_run 记录最近一次触发时间。
+title 留空时按日期命名，一天触发多次的定时再加上时刻。
+不导入 PyQt6，命令行也可使用。
+"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+from storage import FileLock, write_json_atomic, now_stamp
+
+
+DEFAULT_TITLE = '%Y-%m-%d'
+# 一天触发多次的定时默认带上时刻，否则同一天的几次会重名
+DEFAULT_TITLE_INTRADAY = '%Y-%m-%d %H:%M'
+
+
+class CronSchedule:
+    """五段 cron 表达式：分 时 日 月 周，支持 *、数字、a-b、*/n、a-b/n 和逗号列表
+
+    周的 0 和 7 都表示周日。日和周都不是 * 时，满足其一即可（与 cron 相同）。
+    """
+
+    FIELDS = (('分', 0, 59), ('时', 0, 23), ('日', 1, 31), ('月', 1, 12), ('周', 0, 7))
+
+    def __init__(self, expr):
+        self.expr = ' '.join(expr.split())
+        parts = self.expr.split(' ')
+        if len(parts) != 5:
+            raise ValueError(f"定时需要 5 段（分 时 日 月 周）：{expr}")
+        values = [self._parse(part, *field) for part, field in zip(parts, self.FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = values
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def _parse(part, label, low, high):
+        values = set()
+        for item in part.split(','):
+            base, _, step = item.partition('/')
+            try:
+                step = int(step) if step else 1
+                if base == '*':
+                    start, end = low, high
+                elif '-' in base:
+                    start, end = (int(x) for x in base.split('-', 1))
+                else:
+                    start = end = int(base)
+                    if step != 1:
+                        end = high
+            except ValueError:
+                raise ValueError(f"无法解析的{label}：{item}")
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"{label}超出范围 {low}-{high}：{item}")
+            values.update(range(start, end + 1, step))
+        return sorted(values)
+
+    def _day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        in_days = day.day in self.days
+        # Python 周一为 0，cron 周日为 0
+        in_weekdays = (day.weekday() + 1) % 7 in self.weekdays
+        if self.any_day:
+            return in_weekdays
+        if self.any_weekday:
+            return in_days
+        return in_days or in_weekdays
+
+    def next_after(self, moment):
+        """moment（datetime）之后的第一个触发时间"""
+        start = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        # 最多向后找 8 年（2 月 29 日之类的表达式）
+        for _ in range(366 * 8):
+            if self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"定时永远不会触发：{self.expr}")
+
+    def latest_until(self, moment):
+        """moment（datetime）及之前的最后一个触发时间，8 年内没有时返回 None"""
+        end = moment.replace(second=0, microsecond=0)
+        day = end.replace(hour=0, minute=0)
+        for _ in range(366 * 8):
+            if self._day_matches(day):
+                for hour in reversed(self.hours):
+                    for minute in reversed(self.minutes):
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate <= end:
+                            return candidate
+            day -= timedelta(days=1)
+        return None
+
+    def runs_per_day(self):
+        return len(self.hours) * len(self.minutes)
+
+
+def instance_title(template):
+    """项目名中触发时间的 strftime 格式"""
+    if template.get('title'):
+        return template['title']
+    schedule = template.get('schedule')
+    if schedule and CronSchedule(schedule).runs_per_day() > 1:
+        return DEFAULT_TITLE_INTRADAY
+    return DEFAULT_TITLE
+
+
+def due_time(template, now):
+    """模板在 now 之前最近一次应触发的时间（datetime），没有到期时返回 None
+
+    停机期间错过多次时只补建最近的一次，直接从 now 向前找，不逐次遍历错过的触发。
+    """
+    cron = CronSchedule(template['schedule'])
+    latest = cron.latest_until(now)
+    if latest is None or latest.timestamp() <= template.get('last_run', now.timestamp()):
+        return None
+    return latest
+
+
+def next_run(template):
+    """上次触发之后的下一次触发时间（datetime，可能已经错过），未定时返回 None"""
+    if not template.get('schedule'):
+        return None
+    last = datetime.fromtimestamp(template.get('last_run', datetime.now().timestamp()))
+    return CronSchedule(template['schedule']).next_after(last)
+
+
+def build_instance(name, template, when):
+    """按模板生成 when（datetime）那一次的 (项目名, 项目)，名单整体复制"""
+    process_name = f"{name} {when.strftime(instance_title(template))}"
+    current_time, current_ts = now_stamp()
+    process = {
+        "info": {
+            "at_name": list(template.get('at_name', [])),
+            "create_time": current_time,
+            "description": template.get('description', ''),
+            "mode": "on"
+        },
+        "unfinished": list(template.get('roster', [])),
+        "finished": [],
+        "change": {
+            "new_finished": [],
+            "new_unfinished": []
+        },
+        "update_time": current_time,
+        "update_ts": current_ts
+    }
+    if template.get('targets'):
+        process['info']['targets'] = list(template['targets'])
+    return process_name, process
+
+
+class TemplateStore:
+    """templates.json 的读写，多个站点共享 data 目录时在文件锁内修改"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = FileLock(os.path.splitext(path)[0] + '.lock')
+
+    def load(self):
+        """{模板名: 模板}"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def get(self, name):
+        return self.load().get(name)
+
+    def save(self, name, template):
+        """新建或替换模板；定时改变时从现在开始计算下一次"""
+        if template.get('schedule'):
+            cron = CronSchedule(template['schedule'])
+            # 相邻两次触发的项目名相同时，后一次会被当作已建立而跳过
+            title = instance_title(template)
+            first = cron.next_after(datetime.now())
+            second = cron.next_after(first)
+            if first.strftime(title) == second.strftime(title):
+                raise ValueError(f"名称格式 {title} 会使 {first:%Y-%m-%d %H:%M} 和 {second:%Y-%m-%d %H:%M} "
+                                 f"两次触发的项目重名")
+        with self._lock:
+            templates = self.load()
+            old = templates.get(name, {})
+            template = dict(template)
+            if old.get('schedule') == template.get('schedule') and 'last_run' in old:
+                template['last_run'] = old['last_run']
+            else:
+                template['last_run'] = datetime.now().timestamp()
+            templates[name] = template
+            write_json_atomic(self.path, templates)
+
+    def delete(self, name):
+        with self._lock:
+            templates = self.load()
+            if templates.pop(name, None) is not None:
+                write_json_atomic(self.path, templates)
+
+    def mark_run(self, name, when):
+        """记录模板已按 when 创建过项目；其他站点已记录更晚的时间时不改"""
+        with self._lock:
+            templates = self.load()
+            template = templates.get(name)
+            if template is None or template.get('last_run', 0) >= when.timestamp():
+                return
+            template['last_run'] = when.timestamp()
+            write_json_atomic(self.path, templates)
+
+
+def run_template(templates, name, template, add_process, exists, now=None):
+    """模板到期时创建一个项目，返回 (项目名, 是否新建)，未到期返回 None
+
+    add_process(name, process) 返回是否写入；exists(name) 判断同名项目（含归档）。
+    项目名由触发时间决定，多个站点同时触发时只有一个能建立，其余视为已完成。
+    """
+    due = due_time(template, now or datetime.now())
+    if due is None:
+        return None
+    process_name, process = build_instance(name, template, due)
+    added = not exists(process_name) and add_process(process_name, process)
+    templates.mark_run(name, due)
+    return process_name, added
+
+
+def create_due(templates, add_process, exists, now=None):
+    """为所有到期的模板各创建一个项目，返回 [(模板名, 项目名, 是否新建)]"""
+    created = []
+    for name, template in templates.load().items():
+        if not template.get('schedule'):
+            continue
+        try:
+            result = run_template(templates, name, template, add_process, exists, now)
+        except ValueError as e:
+            print(f"Failed to schedule template {name}: {str(e)}")
+            continue
+        if result is not None:
+            created.append((name,) + result)
+    return created
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_templates(path):
+    """按路径返回共享的模板存储"""
+    key = os.path.abspath(path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = TemplateStore(path)
+        return _stores[key]
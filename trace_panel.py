@@ -0,0 +1,67 @@
+import json
+
+from PyQt6.QtWidgets import QDialog, QFileDialog, QMessageBox, QAbstractItemView
+from ui_loader import load_ui
+from tables import fill_table
+import tracing
+
+
+SUMMARY_HEADER = ['名称', '次数', '总耗时 (ms)', '平均 (ms)', '最大 (ms)']
+SPAN_HEADER = ['名称', '开始 (s)', '耗时 (ms)', '线程', '参数']
+# 最近记录中显示的条数
+SPAN_ROWS = 500
+
+
+class TraceDialog(QDialog):
+    """查看和导出性能追踪记录"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        load_ui('trace', self)
+
+        for table in (self.summaryTable, self.spanTable):
+            table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.summaryTable.setSortingEnabled(True)
+
+        self.checkBox.setChecked(tracing.enabled())
+        self.checkBox.toggled.connect(self.toggle)
+        self.pushButton.clicked.connect(self.reload)
+        self.pushButton_2.clicked.connect(self.clear)
+        self.pushButton_3.clicked.connect(lambda: self.export("JSONL (*.jsonl)", '.jsonl', tracing.export_jsonl))
+        self.pushButton_4.clicked.connect(lambda: self.export("Chrome 追踪 (*.json)", '.json', tracing.export_chrome))
+
+        self.reload()
+
+    def toggle(self, checked):
+        tracing.enable(checked)
+        self.reload()
+
+    def clear(self):
+        tracing.clear()
+        self.reload()
+
+    def reload(self):
+        """重新读取缓冲区"""
+        records = tracing.spans()
+        state = "已启用" if tracing.enabled() else "未启用"
+        self.label.setText(f"{state}，缓冲区 {len(records)} / {tracing.BUFFER_SIZE} 条")
+        fill_table(self.summaryTable, SUMMARY_HEADER, [
+            (name, count, round(total, 3), round(mean, 3), round(longest, 3))
+            for name, count, total, mean, longest in tracing.summary(records)])
+        # 最近的在前
+        fill_table(self.spanTable, SPAN_HEADER, [
+            (record.name, round(record.start, 6), round(record.duration * 1000, 3), record.thread,
+             json.dumps(record.args, ensure_ascii=False, default=str))
+            for record in reversed(records[-SPAN_ROWS:])])
+
+    def export(self, file_filter, suffix, writer):
+        """导出全部记录到选择的文件"""
+        path, _ = QFileDialog.getSaveFileName(self, "导出追踪", f"trace{suffix}", file_filter)
+        if not path:
+            return
+        try:
+            writer(path)
+        except OSError as e:
+            QMessageBox.warning(self, "导出失败", str(e))
+            return
+        QMessageBox.information(self, "导出完成", path)
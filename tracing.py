@@ -0,0 +1,151 @@
+"""性能追踪
+
+打开后，各处 span 的耗时记录进环形缓冲区，可在“选项 → 性能追踪”中查看，或导出为 JSONL /
+Chrome 追踪格式（chrome://tracing、ui.perfetto.dev 可直接打开）。
+关闭时 span 返回同一个空上下文，traced 包装的函数直接调用原函数，几乎没有开销。
+
+    python main.py --trace
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+
+BUFFER_SIZE = 10000
+
+# start 为相对 _origin 的秒数，duration 为秒
+Span = namedtuple('Span', ['name', 'start', 'duration', 'thread', 'args'])
+
+_enabled = False
+_buffer = deque(maxlen=BUFFER_SIZE)
+_buffer_lock = threading.Lock()
+_origin = time.perf_counter()
+_origin_wall = time.time()
+
+
+class _NullSpan:
+    """关闭追踪时使用的空上下文"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        with _buffer_lock:
+            _buffer.append(Span(self.name, self.start - _origin, end - self.start, threading.get_ident(), self.args))
+        return False
+
+    def set(self, **args):
+        """补充结束时才知道的参数（如发送结果）"""
+        self.args.update(args)
+
+
+def enabled():
+    return _enabled
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = bool(on)
+
+
+def span(name, **args):
+    """计时一段代码：with span('store.load', backend='json'): ..."""
+    if not _enabled:
+        return _NULL
+    return _Span(name, args)
+
+
+def traced(name=None):
+    """计时整个函数的装饰器，name 默认为函数的限定名"""
+    def decorator(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(label, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def spans():
+    """缓冲区中的全部记录，按结束顺序"""
+    with _buffer_lock:
+        return list(_buffer)
+
+
+def clear():
+    with _buffer_lock:
+        _buffer.clear()
+
+
+def summary(records=None):
+    """按名称汇总 [(名称, 次数, 总耗时, 平均, 最大)]（毫秒），按总耗时从大到小"""
+    totals = {}
+    for record in spans() if records is None else records:
+        count, total, longest = totals.get(record.name, (0, 0.0, 0.0))
+        totals[record.name] = (count + 1, total + record.duration, max(longest, record.duration))
+    rows = [(name, count, total * 1000, total * 1000 / count, longest * 1000)
+            for name, (count, total, longest) in totals.items()]
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows
+
+
+def export_jsonl(path, records=None):
+    """每行一条记录：名称、开始时间（Unix 秒）、耗时（毫秒）、线程和参数"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in spans() if records is None else records:
+            f.write(json.dumps({
+                'name': record.name,
+                'start': round(_origin_wall + record.start, 6),
+                'duration_ms': round(record.duration * 1000, 3),
+                'thread': record.thread,
+                'args': record.args
+            }, ensure_ascii=False, default=str) + '\n')
+
+
+def export_chrome(path, records=None):
+    """Chrome 追踪格式（完整事件，时间单位为微秒）"""
+    pid = os.getpid()
+    events = [{
+        'name': record.name,
+        'cat': record.name.split('.', 1)[0],
+        'ph': 'X',
+        'ts': round(record.start * 1e6, 1),
+        'dur': round(record.duration * 1e6, 1),
+        'pid': pid,
+        'tid': record.thread,
+        'args': record.args
+    } for record in (spans() if records is None else records)]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False, default=str)
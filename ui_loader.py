@@ -0,0 +1,72 @@
+import importlib.util
+import os
+import sys
+
+
+UI_DIR = './ui'
+# 编译生成的 Python 模块缓存目录
+CACHE_DIR = os.path.join(UI_DIR, 'compiled')
+
+
+def _compile(ui_file, py_file):
+    """将 .ui 编译为 Python 模块，先写临时文件再替换"""
+    from PyQt6.uic import compileUi
+    os.makedirs(os.path.dirname(py_file), exist_ok=True)
+    tmp_file = py_file + '.tmp'
+    with open(ui_file, 'r', encoding='utf-8') as src, open(tmp_file, 'w', encoding='utf-8') as dst:
+        compileUi(src, dst)
+    os.replace(tmp_file, py_file)
+
+
+def _compiled_module(name):
+    """返回 name.ui 对应的已编译模块，.ui 比缓存新时重新编译"""
+    ui_file = os.path.join(UI_DIR, f'{name}.ui')
+    py_file = os.path.join(CACHE_DIR, f'ui_{name}.py')
+    try:
+        stale = os.path.getmtime(py_file) < os.path.getmtime(ui_file)
+    except FileNotFoundError:
+        stale = True
+    if stale:
+        _compile(ui_file, py_file)
+
+    module_name = f'_ui_{name}'
+    module = sys.modules.get(module_name)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(module_name, py_file)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[module_name] = module
+    return module
+
+
+def load_ui(name, widget):
+    """与 PyQt6.uic.loadUi 相同的效果，但使用预编译的模块，不在运行时解析 XML
+
+    控件会像 loadUi 一样作为属性挂到 widget 上。
+    """
+    try:
+        module = _compiled_module(name)
+    except Exception as e:
+        # 缓存目录不可写等情况下退回运行时解析
+        print(f"Failed to use compiled UI for {name}: {str(e)}")
+        from PyQt6.uic import loadUi
+        loadUi(os.path.join(UI_DIR, f'{name}.ui'), widget)
+        return
+    ui_class = next(getattr(module, attr) for attr in dir(module) if attr.startswith('Ui_'))
+    ui = ui_class()
+    ui.setupUi(widget)
+    for attr, value in vars(ui).items():
+        setattr(widget, attr, value)
+
+
+def compile_all():
+    """预先编译 ui 目录下所有 .ui 文件"""
+    for file_name in sorted(os.listdir(UI_DIR)):
+        if file_name.endswith('.ui'):
+            name = file_name[:-3]
+            _compile(os.path.join(UI_DIR, file_name), os.path.join(CACHE_DIR, f'ui_{name}.py'))
+            print(f"compiled {file_name}")
+
+
+if __name__ == '__main__':
+    compile_all()